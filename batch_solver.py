@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Solve many sudoku puzzles at once with whole-batch numpy operations
+
+import numpy as np
+from utils import parse_input
+
+INTEGERS = np.arange(1, 10, dtype=np.int8)
+
+
+class BatchSudokuSolver:
+    ''' Solve an (N,9,9) array of puzzles using singles, basic elimination and pointing pairs.
+
+    Pencil marks are held in an (n,9,9,9) tensor indexed [puzzle, integer, row, col]
+    for the active puzzles only; puzzles are dropped from the active set as soon as
+    they are solved, stuck or found to be invalid. Puzzles are processed in chunks
+    of chunk_size to bound memory.
+    '''
+
+    def __init__(self, puzzles, chunk_size=50000):
+
+        # Accept an (N,9,9) array or a list of puzzle strings
+        if len(puzzles) and isinstance(puzzles[0], str):
+            puzzles = [parse_input(puzzle_string) for puzzle_string in puzzles]
+        self.puzzle = np.array(puzzles, dtype=np.int8).reshape(-1, 9, 9)
+        self.status = np.full(len(self.puzzle), 'unsolved', dtype='<U8')
+        self.iterations = np.zeros(len(self.puzzle), dtype=np.int32)
+
+        for start in range(0, len(self.puzzle), chunk_size):
+            self.solve_chunk(np.arange(start, min(start+chunk_size, len(self.puzzle))))
+        return
+
+    def solve_chunk(self, index):
+        ''' Iterate singles and eliminations on puzzles[index] until each one finishes.'''
+        puzzle = self.puzzle[index]
+        pmarks = np.ones((len(index), 9, 9, 9), dtype=bool)
+        iteration = 0
+
+        while len(index):
+            iteration += 1
+            initial_pmarks = count_pmarks(pmarks)
+
+            # Remove pmarks using solved cells and pointing pairs, then place singles
+            update_pmarks(puzzle, pmarks)
+            apply_pointing_pairs(pmarks)
+            identify_solutions(puzzle, pmarks)
+
+            # Classify finished puzzles
+            unknowns = (puzzle==0).sum(axis=(1,2))
+            invalid = find_contradictions(puzzle, pmarks)
+            solved = (unknowns==0) & ~invalid
+            stuck = (count_pmarks(pmarks)==initial_pmarks) & (unknowns>0) & ~invalid
+            finished = invalid | solved | stuck
+
+            # Write back finished puzzles and drop them from the active set
+            if finished.any():
+                done = index[finished]
+                self.puzzle[done] = puzzle[finished]
+                self.iterations[done] = iteration
+                self.status[index[invalid]] = 'invalid'
+                self.status[index[solved]] = 'solved'
+                self.status[index[stuck]] = 'stuck'
+
+                active = ~finished
+                index, puzzle, pmarks = index[active], puzzle[active], pmarks[active]
+        return
+
+
+def update_pmarks(puzzle, pmarks):
+    ''' Remove pmarks at solved cells and in the same row/col/box as solutions.'''
+    solved = puzzle[:,None,:,:]==INTEGERS[None,:,None,None] # [puzzle, integer, row, col]
+
+    row_has = count_along(solved, 3)>0
+    col_has = count_along(solved, 2)>0
+    box_has = count_boxes(solved)>0
+
+    pmarks &= ~row_has[:,:,:,None]
+    pmarks &= ~col_has[:,:,None,:]
+    pmarks.reshape(-1, 9, 3, 3, 3, 3)[...] &= ~box_has[:,:,:,None,:,None]
+    pmarks &= (puzzle==0)[:,None,:,:]
+    return
+
+
+def apply_pointing_pairs(pmarks):
+    ''' Remove pmarks outside a box along a row/col that holds all of the box's pmarks for an integer.'''
+    boxed = pmarks.reshape(-1, 9, 3, 3, 3, 3) # [puzzle, integer, box_row, row, box_col, col]
+
+    # Integers whose box pmarks lie in a single row: remove from that row in the other boxes
+    rows_any = count_along(boxed, 5)>0
+    pointing = rows_any & (count_along(rows_any, 3)==1)[:,:,:,None,:]
+    other_boxes = count_along(pointing, 4)[:,:,:,:,None] - pointing
+    boxed &= ~(other_boxes>0)[:,:,:,:,:,None]
+
+    # Integers whose box pmarks lie in a single column: remove from that column in the other boxes
+    cols_any = count_along(boxed, 3)>0
+    pointing = cols_any & (count_along(cols_any, 4)==1)[:,:,:,:,None]
+    other_boxes = count_along(pointing, 2)[:,:,None,:,:] - pointing
+    boxed &= ~(other_boxes>0)[:,:,:,None,:,:]
+    return
+
+
+def identify_solutions(puzzle, pmarks):
+    ''' Place naked singles and integers with only one possible cell in a row, column or box.'''
+    unknown = puzzle==0
+
+    # Only possible integer in a cell
+    naked = pmarks & (count_along(pmarks, 1)==1)[:,None,:,:]
+
+    # Only possible location in a row, column or box
+    hidden = pmarks & (count_along(pmarks, 3)==1)[:,:,:,None]
+    hidden |= pmarks & (count_along(pmarks, 2)==1)[:,:,None,:]
+    box_single = (count_boxes(pmarks)==1)[:,:,:,None,:,None]
+    hidden |= (pmarks.reshape(-1, 9, 3, 3, 3, 3) & box_single).reshape(pmarks.shape)
+
+    singles = naked | hidden
+    found = (count_along(singles, 1)>0) & unknown
+    values = singles.argmax(axis=1).astype(np.int8) + 1
+    puzzle[found] = values[found]
+    return
+
+
+def find_contradictions(puzzle, pmarks):
+    ''' Flag puzzles with repeated integers in a unit or unsolved cells with no pmarks left.'''
+    solved = puzzle[:,None,:,:]==INTEGERS[None,:,None,None]
+    repeated = (count_along(solved, 3)>1).reshape(len(puzzle), -1).any(axis=1)
+    repeated |= (count_along(solved, 2)>1).reshape(len(puzzle), -1).any(axis=1)
+    repeated |= (count_boxes(solved)>1).reshape(len(puzzle), -1).any(axis=1)
+
+    empty = ((puzzle==0) & (count_along(pmarks, 1)==0)).reshape(len(puzzle), -1).any(axis=1)
+    return repeated | empty
+
+
+def count_along(marks, axis):
+    ''' Count True entries along a short axis by adding uint8 slices (faster than numpy reductions).'''
+    marks = marks.view(np.uint8)
+    index = [slice(None)]*marks.ndim
+    index[axis] = 0
+    total = marks[tuple(index)].copy()
+    for k in range(1, marks.shape[axis]):
+        index[axis] = k
+        total += marks[tuple(index)]
+    return total
+
+
+def count_boxes(marks):
+    ''' Count True entries of an (n,9,9,9) array over each box, giving [puzzle, integer, box_row, box_col].'''
+    return count_along(count_along(marks.reshape(-1, 9, 3, 3, 3, 3), 5), 3)
+
+
+def count_pmarks(pmarks):
+    ''' Total number of pmarks left in each puzzle.'''
+    return np.count_nonzero(pmarks.reshape(len(pmarks), -1), axis=1)
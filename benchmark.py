@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Benchmark the sudoku solver engines on the graded puzzle corpus
+#
+# Usage: python benchmark.py [-e ENGINE ...] [-b BUCKET ...] [-n LIMIT] [--profile] [-o results.json]
+#        python benchmark.py --compare old.json new.json [--threshold 0.1]
+#
+# The corpus lives in puzzles/<bucket>.txt, one 81 character puzzle per line,
+# bucketed by grading.grade_puzzle, the hardest tier of technique the 2024 engine
+# needs: easy (singles), medium (pointing pairs, subsets), hard (fish) and expert
+# (cell forcing or search).
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import sudoku_solver_2022
+import sudoku_solver_2024
+from profiling import TechniqueStats
+from utils import check_errors
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'puzzles')
+BUCKETS = ('easy', 'medium', 'hard', 'expert')
+
+
+def solve_2022(puzzle_string):
+    ''' Run the 2022 solving loop with its output discarded. Return True if solved.'''
+    dashed = '-'.join(puzzle_string[i:i+9] for i in range(0, 81, 9))
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        solver = sudoku_solver_2022.solve_puzzle(dashed)
+    return not (solver.puzzle==0).any() and not check_errors(solver.puzzle, verbose=False)
+
+
+def solve_2024(puzzle_string):
+    ''' Run the 2024 solver in quiet mode. Return True if solved.'''
+    solver = sudoku_solver_2024.SudokuSolver(puzzle_string, verbose=False)
+    return solver.status=='solved' and not check_errors(solver.puzzle, verbose=False)
+
+
+def profile_2024(puzzles):
+    ''' Per-technique stats of the 2024 solver aggregated over puzzles.'''
+    return TechniqueStats.aggregate(
+        sudoku_solver_2024.SudokuSolver(puzzle_string, verbose=False, profile=True).stats for puzzle_string in puzzles)
+
+
+# Engines to benchmark: name -> function(puzzle_string) returning True if solved.
+# Add new engines here.
+ENGINES = {
+    'solver_2022': solve_2022,
+    'solver_2024': solve_2024,
+}
+
+# Engines with per-technique profiling: name -> function(puzzles) returning TechniqueStats
+PROFILERS = {
+    'solver_2024': profile_2024,
+}
+
+
+def load_bucket(bucket, limit=None):
+    ''' Read the puzzles of a corpus bucket.'''
+    with open(os.path.join(CORPUS_DIR, f'{bucket}.txt')) as f:
+        puzzles = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return puzzles[:limit] if limit else puzzles
+
+
+def run_bucket(solve, puzzles, memory_sample=10):
+    ''' Time solve on each puzzle and measure peak memory on a sample.'''
+    latencies = []
+    solved = 0
+    start = time.perf_counter()
+    for puzzle_string in puzzles:
+        t0 = time.perf_counter()
+        solved += bool(solve(puzzle_string))
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+
+    # Peak traced memory per solve, on a separate pass so tracing does not skew timings
+    peak = 0
+    for puzzle_string in puzzles[:memory_sample]:
+        tracemalloc.start()
+        solve(puzzle_string)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'puzzles': len(puzzles),
+        'puzzles_per_sec': len(puzzles)/elapsed,
+        'p50_ms': 1e3*np.percentile(latencies, 50),
+        'p99_ms': 1e3*np.percentile(latencies, 99),
+        'solve_rate': solved/len(puzzles),
+        'peak_memory_kib': peak/1024,
+    }
+
+
+def run_benchmark(engines, buckets, limit=None, memory_sample=10, profile=False):
+    ''' Benchmark each engine on each bucket and return a JSON-serialisable result.'''
+    results = {'meta': describe_environment(), 'results': {}}
+    for name in engines:
+        results['results'][name] = {}
+        for bucket in buckets:
+            puzzles = load_bucket(bucket, limit)
+            stats = run_bucket(ENGINES[name], puzzles, memory_sample)
+            results['results'][name][bucket] = stats
+            print(f"{name:>12} {bucket:>7}: {stats['puzzles_per_sec']:9.1f} puzzles/s  "
+                  f"p50={stats['p50_ms']:8.2f}ms  p99={stats['p99_ms']:8.2f}ms  "
+                  f"solved={100*stats['solve_rate']:5.1f}%  peak={stats['peak_memory_kib']:8.1f}KiB")
+
+            # Per-technique stats, on a separate pass so profiling does not skew timings
+            if profile and name in PROFILERS:
+                techniques = PROFILERS[name](puzzles)
+                stats['techniques'] = techniques.as_dict()
+                print(techniques.table() + '\n')
+    return results
+
+
+def describe_environment():
+    ''' Record where and on what code a benchmark ran.'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+    }
+
+
+def compare(old, new, threshold=0.1):
+    ''' Print per engine/bucket changes between two result files. Return True if any regressed.'''
+    regressed = False
+    print(f"old: {old['meta'].get('commit')} {old['meta'].get('timestamp')}")
+    print(f"new: {new['meta'].get('commit')} {new['meta'].get('timestamp')}")
+    for name, buckets in new['results'].items():
+        for bucket, stats in buckets.items():
+            before = old['results'].get(name, {}).get(bucket)
+            if before is None:
+                continue
+            change = stats['puzzles_per_sec']/before['puzzles_per_sec'] - 1
+            flag = ''
+            if change < -threshold or stats['solve_rate'] < before['solve_rate']:
+                flag = '  REGRESSION'
+                regressed = True
+            print(f"{name:>12} {bucket:>7}: {before['puzzles_per_sec']:9.1f} -> {stats['puzzles_per_sec']:9.1f} puzzles/s "
+                  f"({100*change:+6.1f}%)  p99 {before['p99_ms']:8.2f} -> {stats['p99_ms']:8.2f}ms  "
+                  f"solved {100*before['solve_rate']:5.1f}% -> {100*stats['solve_rate']:5.1f}%{flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark sudoku solver engines on the graded corpus.')
+    parser.add_argument('-e', '--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('-b', '--buckets', nargs='+', default=list(BUCKETS), choices=list(BUCKETS))
+    parser.add_argument('-n', '--limit', type=int, default=None, help='maximum puzzles per bucket')
+    parser.add_argument('--memory-sample', type=int, default=10, help='puzzles per bucket traced for peak memory')
+    parser.add_argument('--profile', action='store_true', help='also record per-technique stats where supported')
+    parser.add_argument('-o', '--output', default=None, help='write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--threshold', type=float, default=0.1, help='throughput drop flagged as a regression')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            regressed = compare(json.load(f_old), json.load(f_new), args.threshold)
+        sys.exit(1 if regressed else 0)
+
+    results = run_benchmark(args.engines, args.buckets, args.limit, args.memory_sample, args.profile)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return
+
+
+if __name__ == '__main__':
+    main()
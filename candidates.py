@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Bitmask candidate store: one mask of possible digits per cell (9 bits on a 9x9 board)
+
+from array import array
+from functools import lru_cache
+from itertools import combinations
+import numpy as np
+from utils import get_board
+
+
+class MaskTable(dict):
+    ''' Lookup table over masks too wide to tabulate in full: entries are computed on first use and kept.'''
+
+    def __init__(self, function):
+        self.function = function
+
+    def __missing__(self, mask):
+        value = self[mask] = self.function(mask)
+        return value
+
+
+class MaskTables:
+    ''' Lookup tables over the candidate masks of a board with size digits (bit d set -> digit d+1 possible).
+
+    Boards up to 9 digits are tabulated in full; wider masks use MaskTable.
+    '''
+
+    def __init__(self, size=9):
+        self.size = size
+        self.all_digits = (1<<size) - 1
+        popcount = int.bit_count
+        lowest_bit = lambda mask: (mask & -mask).bit_length()-1 # -1 for empty mask
+        mask_digits = lambda mask: tuple(d for d in range(size) if mask>>d & 1)
+        if size<=9:
+            masks = range(1<<size)
+            self.popcount = tuple(map(popcount, masks))
+            self.lowest_bit = tuple(map(lowest_bit, masks))
+            self.mask_digits = tuple(map(mask_digits, masks))
+        else:
+            self.popcount = MaskTable(popcount)
+            self.lowest_bit = MaskTable(lowest_bit)
+            self.mask_digits = MaskTable(mask_digits)
+
+
+@lru_cache(maxsize=None)
+def get_mask_tables(size=9):
+    ''' Shared MaskTables for masks of size digits.'''
+    return MaskTables(size)
+
+
+# Lookup tables over all 9-bit candidate masks
+TABLES = get_mask_tables(9)
+ALL_DIGITS = TABLES.all_digits
+POPCOUNT = TABLES.popcount
+LOWEST_BIT = TABLES.lowest_bit
+MASK_DIGITS = TABLES.mask_digits
+
+
+# COMBINATIONS[n][N]: all N-element index tuples of range(n), for subset searches over up to 9 items
+COMBINATIONS = tuple(tuple(tuple(combinations(range(n), N)) for N in range(10)) for n in range(10))
+
+
+def covering_subsets(items, N, popcount=POPCOUNT):
+    ''' Yield (indices, union) for N of the (index, mask) items whose masks combined have exactly N bits.
+
+    Up to 9 items are checked against COMBINATIONS, which is fastest on 9x9 boards;
+    more items use the pruned search of find_covering_subsets.
+    '''
+    if len(items)>9:
+        yield from find_covering_subsets(items, N, popcount=popcount)
+        return
+    for subset in COMBINATIONS[len(items)][N]:
+        union = 0
+        for k in subset:
+            union |= items[k][1]
+        if popcount[union]==N:
+            yield tuple(items[k][0] for k in subset), union
+
+
+def find_covering_subsets(items, N, start=0, chosen=(), union=0, popcount=POPCOUNT):
+    ''' Yield (indices, union) for N of the (index, mask) items whose masks combined have exactly N bits.
+
+    Branches are pruned as soon as the union of the chosen masks grows past N bits, so
+    the search stays small even with many items, unlike enumerating all combinations.
+    '''
+    for k in range(start, len(items)):
+        index, mask = items[k]
+        combined = union | mask
+        if popcount[combined] > N:
+            continue
+        if len(chosen)+1 == N:
+            if popcount[combined] == N:
+                yield chosen + (index,), combined
+        else:
+            yield from find_covering_subsets(items, N, k+1, chosen + (index,), combined, popcount)
+
+
+def mask_typecode(size=9):
+    ''' array typecode holding masks of size digits: uint16 up to 16 digits, else uint32.'''
+    return 'H' if size<=16 else 'I'
+
+
+class CandidateGrid:
+    ''' Candidate digits for all cells, stored as uint16 bitmasks (uint32 for 25x25 boards).
+
+    Removals are stamped with the current serial on the units of the cell and on the
+    digits removed, so a technique can ask for the units (changed_units) or digits
+    (changed_digits) changed since it last ran. Code writing to masks directly must
+    call touch, or touch_all if candidates may have been added back.
+
+    Every removal is also logged as (cell, bits) in trail, so undo(mark) can put back
+    whatever was removed since the trail had mark entries. Masks only ever lose bits
+    between undos, so the trail never holds more than one entry per pmark.
+    '''
+
+    def __init__(self, masks=None, order=3):
+        self.order = order
+        self.board = get_board(order)
+        self.tables = get_mask_tables(self.board.size)
+        self.peers = self.board.peers
+        self.cell_units = self.board.cell_units
+        self.typecode = mask_typecode(self.board.size)
+        if masks is None:
+            self.masks = array(self.typecode, [self.tables.all_digits]*self.board.ncells)
+        else:
+            self.masks = array(self.typecode, masks)
+
+        # Change stamps per unit and digit, and the serial each technique last ran at (all dirty to start with)
+        self.serial = 0
+        self.unit_serials = [0]*len(self.board.units)
+        self.digit_serials = [0]*self.board.size
+        self.checked = {}
+        self.trail = []
+
+    def count(self):
+        ''' Total number of pencil marks left.'''
+        popcount = self.tables.popcount
+        return sum([popcount[mask] for mask in self.masks])
+
+    def eliminate(self, cell, bits):
+        ''' Remove bits from cell. Return True if any candidate was removed.'''
+        mask = self.masks[cell]
+        if mask & bits:
+            self.masks[cell] = mask & ~bits
+            self.touch(cell, mask & bits)
+            return True
+        return False
+
+    def restrict(self, cell, bits):
+        ''' Keep only bits in cell. Return True if any candidate was removed.'''
+        mask = self.masks[cell]
+        if mask & ~bits:
+            self.masks[cell] = mask & bits
+            self.touch(cell, mask & ~bits)
+            return True
+        return False
+
+    def touch(self, cell, bits):
+        ''' Log bits as removed from cell, and mark its units and those digits as changed.'''
+        self.trail.append((cell, bits))
+        serial = self.serial
+        unit_serials = self.unit_serials
+        for iunit in self.cell_units[cell]:
+            unit_serials[iunit] = serial
+        for digit in self.tables.mask_digits[bits]:
+            self.digit_serials[digit] = serial
+
+    def undo(self, mark):
+        ''' Put back the candidates removed since the trail held mark entries.'''
+        masks = self.masks
+        trail = self.trail
+        for cell, bits in trail[mark:]:
+            masks[cell] |= bits
+        del trail[mark:]
+        self.touch_all()
+
+    def touch_all(self):
+        ''' Mark every unit and digit as changed, e.g. after masks were restored.'''
+        serial = self.serial
+        self.unit_serials = [serial]*len(self.unit_serials)
+        self.digit_serials = [serial]*len(self.digit_serials)
+
+    def changed_units(self, key):
+        ''' Iterate over the units changed since changed_units was last called with key, and start a new check for it.
+
+        Units are tested as the iteration reaches them, so a unit changed by the caller
+        earlier in the same pass is included, as in a full scan.
+        '''
+        last = self.checked.get(key, 0)
+        self.serial += 1
+        self.checked[key] = self.serial
+        unit_serials = self.unit_serials
+        return (iunit for iunit in range(len(unit_serials)) if unit_serials[iunit]>=last)
+
+    def changed_digits(self, key):
+        ''' Return the digits changed since changed_digits was last called with key, and start a new check for it.'''
+        last = self.checked.get(key, 0)
+        self.serial += 1
+        self.checked[key] = self.serial
+        return [digit for digit, serial in enumerate(self.digit_serials) if serial>=last]
+
+    def clear_peers(self, cell, digit):
+        ''' Remove digit (0-based) from the row, column and box peers of cell. Return the peers it was removed from.'''
+        bit = 1<<digit
+        masks = self.masks
+        serial = self.serial
+        unit_serials = self.unit_serials
+        cell_units = self.cell_units
+        trail = self.trail
+        cleared = []
+        for peer in self.peers[cell]:
+            if masks[peer] & bit:
+                masks[peer] &= ~bit
+                cleared.append(peer)
+                trail.append((peer, bit))
+                for iunit in cell_units[peer]:
+                    unit_serials[iunit] = serial
+        if cleared:
+            self.digit_serials[digit] = serial
+        return cleared
+
+    def to_pmarks(self):
+        ''' Return candidates as a (size,size,size) boolean array indexed [digit, row, col].'''
+        n = self.board.size
+        grid = np.array(self.masks, dtype=np.uint32).reshape(n,n)
+        return ((grid[None,:,:] >> np.arange(n, dtype=np.uint32)[:,None,None]) & 1).astype(bool)
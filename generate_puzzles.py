@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Generate graded sudoku puzzles with a unique solution on all cores
+#
+# Usage: python generate_puzzles.py [-n COUNT] [-d TIER] [-j workers] [--seed SEED] [--max-attempts N] [-o output]
+#
+# Each output line is an 81 character puzzle (0 for unknown cells) followed by
+# a tab and its tier from grading.grade. Output is streamed in a
+# reproducible order for a given seed, whatever the number of workers. With a
+# tier, clue removal keeps the puzzle from grading harder than it, and a puzzle
+# still missing the tier after --max-attempts grids is skipped and counted on
+# stderr.
+
+import argparse
+import contextlib
+import os
+import random
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from candidates import ALL_DIGITS
+from grading import TIERS, grade
+from solve_puzzles import ordered_map
+from sudoku_solver_2024 import SudokuSolver
+from utils import PEERS
+
+# Clues left before remove_clues starts grading: in sampled runs no puzzle with
+# more clues graded past easy, and skipping those grades halves the cost
+STEER_CLUES = 32
+
+
+def random_grid(rng):
+    ''' Return a random complete grid as a list of 81 integers.'''
+    solver = SudokuSolver('0'*81, verbose=False, techniques=(), solve=False)
+    fill_randomly(solver, rng)
+    return solver.values
+
+
+def fill_randomly(solver, rng):
+    ''' Complete the solver's grid, trying the integers of each branch cell in random order. Return True if filled.'''
+    start = solver.checkpoint()
+    solver.propagate_singles()
+    if solver.has_contradiction():
+        solver.undo(start)
+        return False
+    if 0 not in solver.values:
+        return True
+
+    # Branch on the unsolved cell with the fewest pmarks
+    cell = solver.branch_cell()
+    integers = list(solver.tables.mask_digits[solver.candidates.masks[cell]])
+    rng.shuffle(integers)
+    propagated = solver.checkpoint()
+    for integer in integers:
+        solver.place(cell, integer)
+        solver.propagate()
+        if fill_randomly(solver, rng):
+            return True
+        solver.undo(propagated)
+
+    solver.undo(start)
+    return False
+
+
+def has_other_solution(puzzle, cell, integer):
+    ''' Check whether puzzle (81 integers) has a solution without integer (0-8) at cell.'''
+    # Pmarks straight from the clues, without propagating
+    masks = array('H', [0]*81)
+    for other in range(81):
+        if not puzzle[other]:
+            masks[other] = ALL_DIGITS & ~sum({1<<(puzzle[peer]-1) for peer in PEERS[other] if puzzle[peer]})
+    masks[cell] &= ~(1<<integer)
+    solver = SudokuSolver.from_state(masks, puzzle, verbose=False, techniques=())
+    return solver.count_solutions(limit=1)>0
+
+
+def remove_clues(grid, rng, difficulty=None):
+    ''' Remove clues from a complete grid in random order as long as the solution stays unique,
+    and, if difficulty is given, the puzzle grades no harder than difficulty.
+    '''
+    # Grading after a removal only pays when there is a harder tier to keep out
+    ceiling = TIERS.index(difficulty) if difficulty is not None and difficulty!=TIERS[-1] else None
+    puzzle = list(grid)
+    cells = list(range(81))
+    rng.shuffle(cells)
+    clues = len(cells)
+    for cell in cells:
+        integer = puzzle[cell]-1
+        puzzle[cell] = 0
+        if has_other_solution(puzzle, cell, integer) or (ceiling is not None and clues<=STEER_CLUES+1 and
+                                                         TIERS.index(grade(''.join(map(str, puzzle))))>ceiling):
+            puzzle[cell] = integer+1
+        else:
+            clues -= 1
+    return ''.join(map(str, puzzle))
+
+
+def generate(rng, difficulty=None, max_attempts=1000):
+    ''' Return (puzzle_string, tier) for a unique puzzle, of tier difficulty if given, or None if
+    max_attempts puzzles all grade easier than difficulty.
+    '''
+    for attempt in range(max_attempts):
+        puzzle_string = remove_clues(random_grid(rng), rng, difficulty)
+        tier = grade(puzzle_string)
+        if difficulty is None or tier==difficulty:
+            return puzzle_string, tier
+    return None
+
+
+def generate_batch(seed, count, difficulty=None, max_attempts=1000):
+    ''' Generate count puzzles from seed. Return (one output line per puzzle found, number of misses).'''
+    rng = random.Random(seed)
+    puzzles = [generate(rng, difficulty, max_attempts) for _ in range(count)]
+    return ['\t'.join(puzzle) for puzzle in puzzles if puzzle is not None], puzzles.count(None)
+
+
+def generate_stream(output, count, difficulty=None, workers=None, seed=None, batch_size=8, max_inflight=None,
+                    max_attempts=1000):
+    ''' Generate count puzzles across a process pool, writing each batch to output as it completes in order.
+    Return the number of puzzles skipped because max_attempts tries missed difficulty.
+    '''
+    workers = workers or os.cpu_count() or 1
+    if seed is None:
+        seed = random.randrange(2**32)
+
+    # Each batch is seeded from seed and its index
+    starts = range(0, count, batch_size)
+    seeds = (f'{seed}-{index}' for index in range(len(starts)))
+    counts = (min(batch_size, count-start) for start in starts)
+    skipped = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for lines, misses in ordered_map(pool, generate_batch, seeds, counts, repeat(difficulty), repeat(max_attempts),
+                                         max_inflight=max_inflight or 4*workers):
+            if lines:
+                output.write('\n'.join(lines) + '\n')
+                output.flush()
+            skipped += misses
+    return skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate graded sudoku puzzles with a unique solution.')
+    parser.add_argument('-n', '--count', type=int, default=100, help='number of puzzles (default: 100)')
+    parser.add_argument('-d', '--difficulty', choices=TIERS, default=None, help='only keep puzzles of this tier')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible output')
+    parser.add_argument('--batch-size', type=int, default=8, help='puzzles generated by a worker at a time')
+    parser.add_argument('--max-attempts', type=int, default=1000, help='grids tried per puzzle before skipping it (default: 1000)')
+    parser.add_argument('-o', '--output', default='-', help="output file, or '-' for stdout (default)")
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        output = sys.stdout if args.output=='-' else stack.enter_context(open(args.output, 'w'))
+        skipped = generate_stream(output, args.count, args.difficulty, workers=args.workers,
+                                  seed=args.seed, batch_size=args.batch_size, max_attempts=args.max_attempts)
+    if skipped:
+        print(f'{skipped} puzzles skipped: no {args.difficulty} puzzle in {args.max_attempts} attempts', file=sys.stderr)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Command line entry point to grade a file of sudoku puzzles on all cores
+#
+# Usage: python grade_puzzles.py [input] [-o output] [-j workers] [--no-summary]
+#
+# Puzzles are read as by solve_puzzles.py. Each output line is the puzzle as
+# 81 digits, its tier (or its status if it was not solved, or 'error' if it
+# could not be parsed) and the step counts per tier, tab separated. A summary
+# table of puzzles and mean steps per tier is written to stderr at the end.
+
+import argparse
+import contextlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from grading import TIERS, grade_puzzle
+from solve_puzzles import read_puzzles, chunked, ordered_map
+from utils import parse_input, format_puzzle
+
+
+def grade_lines(lines):
+    ''' Grade a chunk of puzzle lines, returning (puzzle, tier or status, step counts) per puzzle.'''
+    results = []
+    for line in lines:
+        try:
+            puzzle_string = format_puzzle(parse_input(line))
+        except ValueError:
+            results.append(('0'*81, 'error', (0,)*len(TIERS)))
+            continue
+        status, tier, counts = grade_puzzle(puzzle_string)
+        results.append((puzzle_string, tier if status=='solved' else status, counts))
+    return results
+
+
+def grade_stream(lines, output, workers=None, chunk_size=256, max_inflight=None):
+    ''' Grade lines across a process pool, writing results in input order. Return {tier: [puzzles, steps per tier]}.'''
+    workers = workers or os.cpu_count() or 1
+    summary = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for results in ordered_map(pool, grade_lines, chunked(lines, chunk_size), max_inflight=max_inflight or 4*workers):
+            output.write(''.join(f"{puzzle_string}\t{tier}\t{' '.join(map(str, counts))}\n"
+                                 for puzzle_string, tier, counts in results))
+            for puzzle_string, tier, counts in results:
+                entry = summary.setdefault(tier, [0, [0]*len(TIERS)])
+                entry[0] += 1
+                for k, count in enumerate(counts):
+                    entry[1][k] += count
+    return summary
+
+
+def format_summary(summary):
+    ''' Table of puzzles per tier with their mean steps per tier.'''
+    total = sum(entry[0] for entry in summary.values()) or 1
+    lines = [f"{'tier':<11}{'puzzles':>9}{'share':>8}" + ''.join(f'{tier:>9}' for tier in TIERS)]
+    order = list(TIERS) + sorted(set(summary) - set(TIERS))
+    for tier in order:
+        if tier in summary:
+            puzzles, steps = summary[tier]
+            lines.append(f'{tier:<11}{puzzles:>9}{100*puzzles/total:>7.1f}%'
+                         + ''.join(f'{count/puzzles:>9.1f}' for count in steps))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Grade a file of sudoku puzzles by the hardest technique needed.')
+    parser.add_argument('input', nargs='?', default='-', help="puzzle file, or '-' for stdin (default)")
+    parser.add_argument('-o', '--output', default='-', help="output file, or '-' for stdout (default)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=256, help='puzzles sent to a worker at a time')
+    parser.add_argument('--max-inflight', type=int, default=None, help='maximum chunks queued or running (default: 4 per worker)')
+    parser.add_argument('--no-summary', action='store_true', help='do not write the summary table to stderr')
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        source = sys.stdin if args.input=='-' else stack.enter_context(open(args.input))
+        output = sys.stdout if args.output=='-' else stack.enter_context(open(args.output, 'w'))
+        summary = grade_stream(read_puzzles(source), output, workers=args.workers,
+                               chunk_size=args.chunk_size, max_inflight=args.max_inflight)
+    if not args.no_summary:
+        print(format_summary(summary), file=sys.stderr)
+    return
+
+
+if __name__ == '__main__':
+    main()
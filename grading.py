@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Rate sudoku puzzles by the hardest technique the 2024 solver needs
+
+from sudoku_solver_2024 import SudokuSolver
+
+# Difficulty tiers, easiest first, and the tier of each reported technique
+TIERS = ('easy', 'medium', 'hard', 'expert')
+TECHNIQUE_TIERS = {
+    'box_single': 'easy',
+    'row_single': 'easy',
+    'column_single': 'easy',
+    'naked_single': 'easy',
+    'pointing_pair': 'medium',
+    'naked_subset': 'medium',
+    'hidden_subset': 'medium',
+    'xwing': 'hard',
+    'swordfish': 'hard',
+    'jellyfish': 'hard',
+    'cell_forcing': 'expert',
+    'guess': 'expert',
+}
+TIER_INDEX = {technique: TIERS.index(tier) for technique, tier in TECHNIQUE_TIERS.items()}
+
+
+class TierCounts(list):
+    ''' Events sink for SudokuSolver that keeps only the tier index of each step.
+
+    Being a list, it loses the steps of search branches the solver undoes.
+    '''
+
+    def append(self, step):
+        super().append(TIER_INDEX[step[0]])
+
+    def counts(self):
+        ''' Return the number of steps per tier, in TIERS order.'''
+        counts = [0]*len(TIERS)
+        for tier in self:
+            counts[tier] += 1
+        return counts
+
+
+def grade_puzzle(puzzle_string):
+    ''' Solve puzzle_string quietly. Return (status, hardest tier used, step counts per tier in TIERS order).
+
+    Only steps on the path to the solution count, not those of abandoned search branches.
+    '''
+    steps = TierCounts()
+    solver = SudokuSolver(puzzle_string, verbose=False, events=steps)
+    counts = steps.counts()
+    used = [tier for tier, count in zip(TIERS, counts) if count]
+    return solver.status, used[-1] if used else TIERS[0], tuple(counts)
+
+
+def grade(puzzle_string):
+    ''' Return the hardest tier used to solve puzzle_string.'''
+    return grade_puzzle(puzzle_string)[1]
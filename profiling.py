@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Per-technique counters and timers for the solver
+
+class TechniqueStats:
+    ''' Call count, wall time, pmarks removed and idle calls (nothing removed) per technique.
+
+    Stats from several puzzles can be aggregated with += or TechniqueStats.aggregate.
+    '''
+
+    FIELDS = ('calls', 'seconds', 'removed', 'idle_calls')
+
+    def __init__(self):
+        self.techniques = {}
+
+    def record(self, name, seconds, removed):
+        ''' Add one call of technique name.'''
+        entry = self.techniques.get(name)
+        if entry is None:
+            entry = self.techniques[name] = [0, 0.0, 0, 0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += removed
+        entry[3] += removed==0
+
+    def __iadd__(self, other):
+        for name, values in other.techniques.items():
+            entry = self.techniques.setdefault(name, [0, 0.0, 0, 0])
+            for k, value in enumerate(values):
+                entry[k] += value
+        return self
+
+    @classmethod
+    def aggregate(cls, stats_list):
+        ''' Combine the stats of many puzzles.'''
+        total = cls()
+        for stats in stats_list:
+            total += stats
+        return total
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for name, entry in data.items():
+            stats.techniques[name] = [entry[field] for field in cls.FIELDS]
+        return stats
+
+    def as_dict(self):
+        ''' Export as {technique: {calls, seconds, removed, idle_calls}}.'''
+        return {name: dict(zip(self.FIELDS, entry)) for name, entry in self.techniques.items()}
+
+    def table(self):
+        ''' Format the stats as a text table, most expensive technique first.'''
+        lines = [f"{'technique':<16}{'calls':>9}{'time (ms)':>12}{'ms/call':>10}{'removed':>10}{'idle %':>8}"]
+        for name, (calls, seconds, removed, idle) in sorted(self.techniques.items(), key=lambda item: -item[1][1]):
+            lines.append(f'{name:<16}{calls:>9}{1e3*seconds:>12.2f}{1e3*seconds/calls:>10.3f}{removed:>10}{100*idle/calls:>8.1f}')
+        return '\n'.join(lines)
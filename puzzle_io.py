@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Memory-mapped columnar input and output for solving millions of puzzles
+#
+# Usage: python puzzle_io.py input results_dir [-j workers] [--order N] [--text output]
+#
+# The input holds one puzzle per line, each exactly n*n symbols ('0' or '.' for
+# unknown cells) followed by '\n' or '\r\n'; a trailing blank line is ignored. It
+# is memory-mapped and decoded a chunk at a time with a lookup table, and the
+# solver is built straight from the decoded values, with no per-line parsing.
+#
+# Results go to results_dir as preallocated .npy columns, readable with
+# np.load(path, mmap_mode='r'):
+#
+#   solutions.npy  (N, n*n) uint8   solved grid, 0 where unsolved
+#   status.npy     (N,)     uint8   index into STATUS_NAMES
+#   steps.npy      (N,)     uint32  deductions on the path to the solution, guesses included
+#   hardest.npy    (N,)     uint8   index into TECHNIQUE_NAMES of the hardest step
+#   progress.npy   (1,)     int64   puzzles done: the resume marker
+#   source.npy     (4,)     int64   size, mtime and checksums of the input
+#
+# Columns are flushed before the marker, so rerunning an interrupted job
+# continues from the first puzzle not yet written. A directory holding results
+# for a different input is refused rather than overwritten.
+
+import argparse
+import contextlib
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from grading import TECHNIQUE_TIERS, TIER_INDEX
+from solve_puzzles import ordered_map
+from sudoku_solver_2024 import SudokuSolver, STATUSES
+from utils import SYMBOLS, get_board
+
+INVALID = 255
+NEWLINE = ord('\n')
+LINE_BREAKS = np.frombuffer(b'\r\n', dtype=np.uint8)
+STATUS_NAMES = STATUSES + ('error',)
+FINGERPRINT_BYTES = 1<<16
+
+# Techniques easiest first: by tier, then within a tier naked singles (read straight
+# off the pmarks) before hidden singles, box scans before line scans, and smaller
+# subsets and fish before larger ones
+WITHIN_TIER = ('naked_single', 'box_single', 'row_single', 'column_single',
+               'pointing_pair', 'naked_subset', 'hidden_subset',
+               'xwing', 'swordfish', 'jellyfish',
+               'cell_forcing', 'guess')
+TECHNIQUE_NAMES = ('none',) + tuple(sorted(TECHNIQUE_TIERS, key=lambda name: (TIER_INDEX[name], WITHIN_TIER.index(name))))
+TECHNIQUE_INDEX = {name: k for k, name in enumerate(TECHNIQUE_NAMES)}
+
+
+def symbol_tables(order=3):
+    ''' Return (decode, encode) lookup tables between symbol bytes and integers for a board of the given order.'''
+    n = order*order
+    decode = np.full(256, INVALID, dtype=np.uint8)
+    decode[ord('.')] = 0
+    for k, symbol in enumerate('0' + SYMBOLS[:n]):
+        decode[ord(symbol)] = decode[ord(symbol.lower())] = k
+    encode = np.frombuffer(('0' + SYMBOLS[:n]).encode(), dtype=np.uint8)
+    return decode, encode
+
+
+class PuzzleFile:
+    ''' File of fixed-width puzzle lines, memory-mapped and decoded in slices.'''
+
+    def __init__(self, path, order=3):
+        self.path = path
+        self.order = order
+        self.ncells = get_board(order).ncells
+        self.decode_table, _ = symbol_tables(order)
+        self.size = os.path.getsize(path)
+        self.data = np.memmap(path, dtype=np.uint8, mode='r') if self.size else np.zeros(0, dtype=np.uint8)
+
+        # Line width from the first line, allowing '\r\n' and a missing final newline
+        head = np.asarray(self.data[:self.ncells+2])
+        newlines = np.flatnonzero(head==NEWLINE)
+        self.width = newlines[0]+1 if len(newlines) else self.size+1
+        if self.size and self.width not in (self.ncells+1, self.ncells+2):
+            raise ValueError(f'{path} is not a file of {self.ncells}-symbol puzzle lines')
+        self.count = -(-self.size//self.width)
+
+        # A final partial line of only line breaks is a trailing blank line, not a puzzle
+        tail = np.asarray(self.data[self.size - self.size%self.width:])
+        if len(tail) and np.isin(tail, LINE_BREAKS).all():
+            self.count -= 1
+
+    def __len__(self):
+        return self.count
+
+    def fingerprint(self):
+        ''' Return the file size, mtime and CRC32s of its first and last 64 KiB, to tell input files apart on resume.'''
+        head = np.asarray(self.data[:FINGERPRINT_BYTES])
+        tail = np.asarray(self.data[-FINGERPRINT_BYTES:])
+        mtime = os.stat(self.path).st_mtime_ns
+        return np.array([self.size, mtime, zlib.crc32(head), zlib.crc32(tail)], dtype=np.int64)
+
+    def decode(self, start=0, stop=None):
+        ''' Return puzzles start to stop as a (k, n*n) uint8 array; lines with a bad symbol or width are all INVALID.'''
+        stop = self.count if stop is None else min(stop, self.count)
+        raw = np.asarray(self.data[start*self.width:stop*self.width])
+        if len(raw) % self.width:
+            raw = np.concatenate((raw, np.full(self.width - len(raw)%self.width, NEWLINE, dtype=np.uint8)))
+        lines = raw.reshape(-1, self.width)
+        puzzles = self.decode_table[lines[:, :self.ncells]]
+
+        # A line of the wrong width shifts the newline out of the last column
+        bad = (lines[:, -1]!=NEWLINE) | (puzzles==INVALID).any(axis=1)
+        puzzles[bad] = INVALID
+        return puzzles
+
+
+def encode_puzzles(puzzles, order=3):
+    ''' Encode an (N, n*n) integer array as fixed-width text lines, returned as bytes.'''
+    _, encode = symbol_tables(order)
+    puzzles = np.asarray(puzzles)
+    lines = np.empty((len(puzzles), puzzles.shape[1]+1), dtype=np.uint8)
+    lines[:, :-1] = encode[puzzles]
+    lines[:, -1] = NEWLINE
+    return lines.tobytes()
+
+
+class ResultColumns:
+    ''' Preallocated memory-mapped result columns in a directory, with a resume marker.
+
+    Opening a directory that already holds columns for the same input (count
+    puzzles of the same board, and the same source fingerprint) reuses them, and
+    done is read back from the marker. A directory with results for any other
+    input raises ValueError. Otherwise the columns are created and done is 0.
+    '''
+
+    def __init__(self, directory, count, order=3, source=None):
+        source = np.zeros(4, dtype=np.int64) if source is None else np.asarray(source, dtype=np.int64)
+        ncells = get_board(order).ncells
+        shapes = {
+            'solutions': ((count, ncells), np.uint8),
+            'status': ((count,), np.uint8),
+            'steps': ((count,), np.uint32),
+            'hardest': ((count,), np.uint8),
+            'source': (source.shape, np.int64),
+            'progress': ((1,), np.int64),
+        }
+        os.makedirs(directory, exist_ok=True)
+        paths = {name: os.path.join(directory, f'{name}.npy') for name in shapes}
+
+        # The marker is created last, so a directory without it holds no results yet
+        if os.path.exists(paths['progress']):
+            columns = {name: np.load(path, mmap_mode='r+') for name, path in paths.items() if os.path.exists(path)}
+            same = all(name in columns and columns[name].shape==shape and columns[name].dtype==dtype
+                       for name, (shape, dtype) in shapes.items())
+            if not same or not np.array_equal(columns['source'], source):
+                raise ValueError(f'{directory} holds results for a different input; use another directory or remove it')
+        else:
+            columns = {name: np.lib.format.open_memmap(paths[name], mode='w+', dtype=dtype, shape=shape)
+                       for name, (shape, dtype) in shapes.items()}
+            columns['source'][:] = source
+            columns['source'].flush()
+
+        self.columns = columns
+        self.count = count
+        self.done = int(columns['progress'][0])
+
+    def write(self, start, results):
+        ''' Write a chunk of results (a column name -> array dict) at puzzle start.'''
+        for name, values in results.items():
+            self.columns[name][start:start+len(values)] = values
+
+    def commit(self, done):
+        ''' Flush the columns to disk, then advance the resume marker to done.'''
+        for name, column in self.columns.items():
+            if name!='progress':
+                column.flush()
+        progress = self.columns['progress']
+        progress[0] = done
+        progress.flush()
+        self.done = done
+
+
+class StepStats(list):
+    ''' Events sink for SudokuSolver that keeps the technique index of each step.
+
+    Being a list, it loses the steps of search branches the solver undoes.
+    '''
+
+    def append(self, step):
+        super().append(TECHNIQUE_INDEX[step[0]])
+
+    @property
+    def steps(self):
+        return len(self)
+
+    @property
+    def hardest(self):
+        return max(self, default=0)
+
+
+def solve_array(puzzles, order=3):
+    ''' Solve an (k, n*n) uint8 array of decoded puzzles. Return a dict of result columns.'''
+    results = {
+        'solutions': np.zeros(puzzles.shape, dtype=np.uint8),
+        'status': np.zeros(len(puzzles), dtype=np.uint8),
+        'steps': np.zeros(len(puzzles), dtype=np.uint32),
+        'hardest': np.zeros(len(puzzles), dtype=np.uint8),
+    }
+    invalid = (puzzles==INVALID).any(axis=1)
+    for k in range(len(puzzles)):
+        if invalid[k]:
+            results['status'][k] = STATUS_NAMES.index('error')
+            continue
+        stats = StepStats()
+        solver = SudokuSolver.from_values(puzzles[k].tolist(), verbose=False, events=stats, order=order)
+        results['solutions'][k] = solver.values
+        results['status'][k] = STATUS_NAMES.index(solver.status)
+        results['steps'][k] = stats.steps
+        results['hardest'][k] = stats.hardest
+    return results
+
+
+def solve_file(path, directory, order=3, workers=None, chunk_size=1024, max_inflight=None):
+    ''' Solve the puzzles of a fixed-width file into result columns, resuming from the marker. Return the ResultColumns.'''
+    workers = workers or os.cpu_count() or 1
+    puzzles = PuzzleFile(path, order)
+    results = ResultColumns(directory, len(puzzles), order, puzzles.fingerprint())
+
+    # Chunks come back in input order, so the marker only moves forward
+    starts = range(results.done, len(puzzles), chunk_size)
+    chunks = (puzzles.decode(start, start+chunk_size) for start in starts)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start, chunk in zip(starts, ordered_map(pool, solve_array, chunks, repeat(order), max_inflight=max_inflight or 4*workers)):
+            results.write(start, chunk)
+            results.commit(start + len(chunk['status']))
+    return results
+
+
+def export_text(results, output, order=3, chunk_size=65536):
+    ''' Write the solutions of ResultColumns to output (a binary stream) as fixed-width lines.'''
+    solutions = results.columns['solutions']
+    for start in range(0, len(solutions), chunk_size):
+        output.write(encode_puzzles(solutions[start:start+chunk_size], order))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve a fixed-width puzzle file into memory-mapped result columns.')
+    parser.add_argument('input', help='file of puzzles, one fixed-width line each')
+    parser.add_argument('results', help='directory for the result columns; an interrupted run resumes from it')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--order', type=int, default=3, help='box size: 3 for 9x9 (default), 4 for 16x16, 5 for 25x25')
+    parser.add_argument('--chunk-size', type=int, default=1024, help='puzzles sent to a worker at a time')
+    parser.add_argument('--text', default=None, help="also write the solutions as text to this file, or '-' for stdout")
+    args = parser.parse_args(argv)
+
+    try:
+        results = solve_file(args.input, args.results, order=args.order, workers=args.workers, chunk_size=args.chunk_size)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.text:
+        with contextlib.ExitStack() as stack:
+            output = sys.stdout.buffer if args.text=='-' else stack.enter_context(open(args.text, 'wb'))
+            export_text(results, output, order=args.order)
+
+    counts = np.bincount(results.columns['status'], minlength=len(STATUS_NAMES))
+    print(f'{results.count} puzzles: ' + ', '.join(f'{count} {name}' for name, count in zip(STATUS_NAMES, counts)),
+          file=sys.stderr)
+    return
+
+
+if __name__ == '__main__':
+    main()
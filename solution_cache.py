@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# Cache sudoku solutions under the symmetries that preserve solvability
+#
+# Two puzzles are equivalent if one maps to the other by relabelling digits,
+# permuting bands or stacks, permuting rows within a band or columns within a
+# stack, and transposing. canonical_form picks the lexicographically smallest
+# relabelled grid of the class, so equivalent puzzles share one cache entry.
+
+import shelve
+import time
+from collections import Counter, OrderedDict
+from itertools import permutations
+
+import numpy as np
+
+from sudoku_solver_2024 import SudokuSolver
+from utils import parse_input, format_puzzle
+
+# The 1296 orderings of columns that keep stacks together
+TRIPLES = tuple(permutations(range(3)))
+COL_PERMS = np.array([
+    [3*stack + TRIPLES[within[stack]][k] for stack in stacks for k in range(3)]
+    for stacks in TRIPLES
+    for within in np.ndindex(6, 6, 6)
+], dtype=np.intp)
+ROW_BAND = np.arange(9)//3
+PLACE_VALUES = 10**np.arange(8, -1, -1, dtype=np.int64)
+PATTERN_VALUES = 2**np.arange(8, -1, -1)
+
+# Sparse or very symmetric grids tie on thousands of transforms at every row (an
+# empty grid on all 23328 first rows); no corpus puzzle keeps more than 3888
+MAX_TIES = 8192
+
+
+def clue_signature(puzzle):
+    ''' Return a cheap invariant of the puzzle's class: its clue counts per row within each band, per column
+    within each stack, and per digit, each sorted so that every equivalent puzzle gives the same tuple.
+    '''
+    clues = np.asarray(puzzle).reshape(9, 9)>0
+    def lines(counts):
+        return tuple(sorted(tuple(sorted(band)) for band in counts.reshape(3, 3).tolist()))
+    digits = np.bincount(np.asarray(puzzle).ravel(), minlength=10)[1:]
+    return tuple(sorted((lines(clues.sum(axis=1)), lines(clues.sum(axis=0))))) + (tuple(sorted(digits.tolist())),)
+
+
+def canonical_form(puzzle, max_ties=MAX_TIES):
+    ''' Return the canonical (9,9) grid equivalent to puzzle, and the transform that maps puzzle onto it.
+
+    The transform is (transpose, row_order, col_order, digit_map): canonical[i,j] is
+    digit_map[grid[row_order[i], col_order[j]]], with grid transposed first if transpose.
+    The first row and the column orders it allows come straight from clue counts per
+    stack; later rows are chosen one at a time, keeping every candidate transform that
+    gives the smallest row so far, with digits relabelled in order of first appearance.
+    Return None if more than max_ties transforms tie for a row, which bounds time and
+    memory, or if a row or column repeats a digit.
+    '''
+    puzzle = np.asarray(puzzle, dtype=np.uint8).reshape(9, 9)
+    oriented = np.stack((puzzle, puzzle.T))
+    counts = np.zeros((18, 10), dtype=np.intp)
+    np.add.at(counts, (np.arange(18)[:, None], oriented.reshape(18, 9)), 1)
+    if (counts[:, 1:]>1).any():
+        return None
+
+    # The first row relabels to 1, 2, ... in order, so only its clue pattern counts, and
+    # the smallest pattern comes from the rows whose stacks, emptiest first, hold the
+    # fewest clues: [transpose, row, stack] counts sorted within each row
+    clues = oriented>0
+    stack_counts = np.sort(clues.reshape(2, 9, 3, 3).sum(axis=3), axis=2)
+    keys = stack_counts @ np.array([16, 4, 1])
+    transposes, first_rows = np.nonzero(keys==keys.min())
+
+    # Column orders that give those rows the smallest pattern
+    patterns = clues[transposes, first_rows][:, COL_PERMS] @ PATTERN_VALUES
+    pick, col_perms = np.nonzero(patterns==patterns.min())
+    if len(pick)>max_ties:
+        return None
+    transposes, col_orders = transposes[pick], COL_PERMS[col_perms]
+    index = np.arange(len(pick))
+    orders = np.zeros((len(pick), 0), dtype=np.intp)
+    digit_map = np.zeros((len(pick), 10), dtype=np.uint8)
+    labels = np.ones(len(pick), dtype=np.uint8)
+
+    rows = []
+    for position in range(9):
+        # Rows allowed next: the chosen first row, a fresh band at the start of a band, otherwise the current band
+        if position==0:
+            allowed = np.arange(9)[None, :]==first_rows[pick][:, None]
+        else:
+            used = np.zeros((len(index), 9), dtype=bool)
+            used[np.arange(len(index))[:, None], orders] = True
+            if position%3==0:
+                band_used = used.reshape(-1, 3, 3).any(axis=2)
+                allowed = ~band_used[:, ROW_BAND]
+            else:
+                allowed = ~used & (ROW_BAND[None, :]==ROW_BAND[orders[:, -1]][:, None])
+        parent, irow = np.nonzero(allowed)
+
+        # Relabel each candidate row: digits already mapped keep their label, and as no digit
+        # repeats within a row, each new one takes the next label in order of appearance
+        candidate = index[parent]
+        row = oriented[transposes[candidate][:, None], irow[:, None], col_orders[candidate]]
+        mapped = digit_map[parent[:, None], row]
+        new = (row>0) & (mapped==0)
+        added = np.cumsum(new, axis=1, dtype=np.uint8)
+        relabelled = np.where(new, labels[parent][:, None] + added - 1, mapped)
+
+        # Keep only the candidates giving the smallest row, extending their digit maps
+        keys = relabelled.astype(np.int64) @ PLACE_VALUES
+        best = np.flatnonzero(keys==keys.min())
+        if len(best)>max_ties:
+            return None
+        rows.append(relabelled[best[0]])
+        index, digit_map, labels = candidate[best], digit_map[parent[best]], labels[parent[best]] + added[best, -1]
+        digit_map[np.arange(len(best))[:, None], row[best]] = relabelled[best]
+        orders = np.concatenate((orders[parent[best]], irow[best][:, None]), axis=1)
+
+    # Any remaining candidate is an automorphism of the grid; give absent digits the unused labels
+    digit_map = digit_map[0]
+    absent = [digit for digit in range(1, 10) if digit_map[digit]==0]
+    digit_map[absent] = np.arange(labels[0], 10)
+    transform = (bool(transposes[index[0]]), orders[0], col_orders[index[0]], digit_map)
+    return np.array(rows, dtype=np.int8), transform
+
+
+def apply_transform(grid, transform):
+    ''' Map a grid (puzzle or solution) the way canonical_form mapped its puzzle.'''
+    transpose, row_order, col_order, digit_map = transform
+    grid = np.asarray(grid).reshape(9, 9)
+    if transpose:
+        grid = grid.T
+    return digit_map[grid[np.ix_(row_order, col_order)]].astype(np.int8)
+
+
+def invert_transform(grid, transform):
+    ''' Map a canonical grid back to the original puzzle's frame.'''
+    transpose, row_order, col_order, digit_map = transform
+    inverse_map = np.zeros(10, dtype=np.int8)
+    inverse_map[digit_map] = np.arange(10)
+    original = np.zeros((9, 9), dtype=np.int8)
+    original[np.ix_(row_order, col_order)] = inverse_map[np.asarray(grid).reshape(9, 9)]
+    return original.T.copy() if transpose else original
+
+
+class SolutionCache:
+    ''' Bounded LRU of solutions keyed by puzzle, shared across symmetric puzzles.
+
+    Entries map an 81 digit puzzle string to (81 digit result, status). A puzzle seen
+    before is answered by a dictionary lookup. Otherwise, if a cached class shares its
+    clue_signature, it is canonicalised and looked up by its canonical form in memory,
+    then in the optional shelve file at path; only then is it solved. A solved puzzle
+    is also stored under its canonical form when solving it took longer than the
+    mean canonicalisation, so cheap puzzles never pay for canonical_form.
+
+    An exact repeat costs about 70 us. A symmetric variant costs a canonicalisation,
+    about 1.5 ms and 2 ms per lookup in all, which is as long as solving an easy
+    puzzle: only hard and expert puzzles (4 and 15 ms to solve) gain from it.
+    '''
+
+    def __init__(self, maxsize=100000, path=None, **solver_options):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.disk = shelve.open(path) if path else None
+        self.solver_options = dict(verbose=False, **solver_options)
+        self.hits = self.canonical_hits = self.disk_hits = self.misses = 0
+
+        # Signatures of the canonical entries in memory, to skip canonicalising certain misses
+        self.signatures = Counter()
+        self.canonical_keys = {}
+        self.canonical_seconds = 0.0
+        self.canonicalised = 0
+        return
+
+    def solve(self, puzzle_string):
+        ''' Return (puzzle, status) for puzzle_string, as SudokuSolver would give them.'''
+        puzzle = parse_input(puzzle_string)
+        key = format_puzzle(puzzle)
+        entry = self.lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return parse_input(entry[0]), entry[1]
+
+        # Same class as a cached puzzle: map its result back
+        signature = clue_signature(puzzle)
+        canonical = None
+        if self.known_signature(signature):
+            canonical = self.canonicalise(puzzle)
+        if canonical is not None:
+            canonical_key = format_puzzle(canonical[0])
+            entry = self.lookup(canonical_key)
+            if entry is None and self.disk is not None and canonical_key in self.disk:
+                entry = self.disk[canonical_key]
+                self.store(canonical_key, entry, signature)
+                self.disk_hits += 1
+            elif entry is not None:
+                self.canonical_hits += 1
+            if entry is not None:
+                result = invert_transform(parse_input(entry[0]), canonical[1])
+                self.store(key, (format_puzzle(result), entry[1]))
+                return result, entry[1]
+
+        # Miss: solve and store under the puzzle, and under its canonical form if that will pay
+        self.misses += 1
+        start = time.perf_counter()
+        solver = SudokuSolver(key, **self.solver_options)
+        seconds = time.perf_counter() - start
+        self.store(key, (format_puzzle(solver.puzzle), solver.status))
+        if canonical is None and (not self.canonicalised or seconds>self.canonical_seconds/self.canonicalised):
+            canonical = self.canonicalise(puzzle)
+        if canonical is not None:
+            canonical_key = format_puzzle(canonical[0])
+            canonical_entry = (format_puzzle(apply_transform(solver.puzzle, canonical[1])), solver.status)
+            self.store(canonical_key, canonical_entry, signature)
+            if self.disk is not None:
+                self.disk[canonical_key] = canonical_entry
+                self.disk[f'signature {signature}'] = True
+        return solver.puzzle, solver.status
+
+    def canonicalise(self, puzzle):
+        ''' Return canonical_form(puzzle), or None if too many transforms tie, timing the call.'''
+        start = time.perf_counter()
+        canonical = canonical_form(puzzle)
+        self.canonical_seconds += time.perf_counter() - start
+        self.canonicalised += 1
+        return canonical
+
+    def known_signature(self, signature):
+        ''' Return True if a canonical entry in memory or on disk has this clue_signature.'''
+        return self.signatures[signature]>0 or (self.disk is not None and f'signature {signature}' in self.disk)
+
+    def lookup(self, key):
+        ''' Return the entry for key, marking it most recently used, or None.'''
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key, entry, signature=None):
+        ''' Add an entry, evicting the least recently used beyond maxsize. Pass the signature of canonical entries.'''
+        if signature is not None and key not in self.canonical_keys:
+            self.canonical_keys[key] = signature
+            self.signatures[signature] += 1
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries)>self.maxsize:
+            evicted, _ = self.entries.popitem(last=False)
+            evicted_signature = self.canonical_keys.pop(evicted, None)
+            if evicted_signature is not None:
+                self.signatures[evicted_signature] -= 1
+                if not self.signatures[evicted_signature]:
+                    del self.signatures[evicted_signature]
+        return
+
+    def close(self):
+        ''' Close the on-disk tier, if any.'''
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+        return
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Command line entry point to solve a file of sudoku puzzles on all cores
+#
+# Usage: python solve_puzzles.py [input] [-o output] [-j workers]
+#
+# Puzzles are read one per line, either dash-separated ('400008060-700020105-...')
+# or 81 characters with '0' or '.' for unknown cells. Blank lines and lines
+# starting with '#' are skipped. Each output line is the solved grid as 81
+# digits (0 where unsolved) followed by a tab and the solver status.
+
+import argparse
+import contextlib
+import itertools
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from sudoku_solver_2024 import SudokuSolver
+from utils import format_puzzle
+
+
+def solve_lines(lines):
+    ''' Solve a chunk of puzzle lines, returning one output line per puzzle.'''
+    results = []
+    for line in lines:
+        try:
+            solver = SudokuSolver(line, verbose=False)
+        except ValueError:
+            results.append(f'{"0"*81}\terror')
+            continue
+        results.append(f'{format_puzzle(solver.puzzle)}\t{solver.status}')
+    return results
+
+
+def read_puzzles(stream):
+    ''' Yield puzzle lines from stream without reading it all into memory.'''
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def chunked(iterable, size):
+    ''' Yield lists of up to size items from iterable.'''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ordered_map(pool, function, *iterables, max_inflight):
+    ''' Like pool.map, but items are submitted lazily with at most max_inflight pending, so input can stream.
+
+    Results are yielded in input order: the oldest submission is always waited on first.
+    '''
+    pending = deque()
+    for args in zip(*iterables):
+        if len(pending)>=max_inflight:
+            yield pending.popleft().result()
+        pending.append(pool.submit(function, *args))
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def solve_stream(lines, output, workers=None, chunk_size=64, max_inflight=None):
+    ''' Solve lines across a process pool, writing results to output in input order.'''
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for results in ordered_map(pool, solve_lines, chunked(lines, chunk_size), max_inflight=max_inflight or 4*workers):
+            output.write('\n'.join(results) + '\n')
+    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve a file of sudoku puzzles, one per line.')
+    parser.add_argument('input', nargs='?', default='-', help="puzzle file, or '-' for stdin (default)")
+    parser.add_argument('-o', '--output', default='-', help="output file, or '-' for stdout (default)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=64, help='puzzles sent to a worker at a time')
+    parser.add_argument('--max-inflight', type=int, default=None, help='maximum chunks queued or running (default: 4 per worker)')
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        source = sys.stdin if args.input=='-' else stack.enter_context(open(args.input))
+        output = sys.stdout if args.output=='-' else stack.enter_context(open(args.output, 'w'))
+        solve_stream(read_puzzles(source), output, workers=args.workers,
+                     chunk_size=args.chunk_size, max_inflight=args.max_inflight)
+    return
+
+
+if __name__ == '__main__':
+    main()
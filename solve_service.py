@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# Long-running local solve service: asyncio HTTP over TCP or a Unix socket
+#
+# Usage: python solve_service.py [--host HOST] [--port PORT | --unix PATH] [-j workers]
+#
+#   POST /solve  {"puzzle": "4000080..."}        -> {"solution": "41...", "status": "solved"}
+#                {"puzzles": ["...", "..."]}     -> {"results": [{"solution": ..., "status": ...}, ...]}
+#   GET /health                                   -> {"ok": true, "pool": "ready", "pending": 0, "workers": 4, "restarts": 0}
+#
+# Concurrent requests are coalesced into micro-batches and solved by a warm
+# process pool with solve_puzzles.solve_lines. When more than max_pending
+# puzzles are waiting, new requests get 503 at once; a request whose puzzles
+# are not solved within its timeout gets 504, and one that fails gets 500.
+# If a worker dies the pool is replaced with a fresh warm one; /health answers
+# 503 until it is ready again.
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from solve_puzzles import solve_lines
+
+WARM_PUZZLE = '0'*81
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+def reset_signals():
+    ''' Pool initializer: drop the signal handling a worker forked from the running service inherits.
+
+    The service's event loop takes signals through a wakeup fd; a worker that kept it
+    would pass on the SIGTERM it gets when its pool breaks, and shut the service down.
+    '''
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+class Overloaded(Exception):
+    ''' Raised when the queue of pending puzzles is full.'''
+
+
+class BatchSolver:
+    ''' Coalesce puzzles from concurrent requests into batches for a process pool.
+
+    Puzzles wait in a bounded queue; a dispatcher takes up to batch_size of them,
+    waiting at most batch_delay seconds for a batch to fill, and keeps at most
+    2 batches per worker in flight. A pool broken by a dead worker is replaced.
+    '''
+
+    def __init__(self, workers=None, batch_size=32, batch_delay=0.002, max_pending=4096):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.inflight = asyncio.Semaphore(2*self.workers)
+        self.pool = None
+        self.ready = asyncio.Event()
+        self.restarts = 0
+        self.dispatcher = None
+
+        # Strong references to running batch tasks, which the loop only holds weakly
+        self.tasks = set()
+
+    async def start(self):
+        ''' Start a warm pool and start dispatching.'''
+        self.pool = await self.warm_pool()
+        self.ready.set()
+        self.dispatcher = asyncio.create_task(self.dispatch())
+
+    async def warm_pool(self):
+        ''' Return a new pool that has solved one puzzle per worker, so imports are done.'''
+        loop = asyncio.get_running_loop()
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=reset_signals)
+        await asyncio.gather(*(loop.run_in_executor(pool, solve_lines, [WARM_PUZZLE])
+                               for _ in range(self.workers)))
+        return pool
+
+    async def replace_pool(self, broken):
+        ''' Replace the broken pool with a fresh warm one, once however many batches saw it break.'''
+        if self.pool is not broken or not self.ready.is_set():
+            return
+        self.ready.clear()
+        broken.shutdown(wait=False, cancel_futures=True)
+        try:
+            self.pool = await self.warm_pool()
+            self.restarts += 1
+        finally:
+            self.ready.set()
+
+    def pool_state(self):
+        ''' Return 'ready', 'restarting', or 'broken' if a worker has died since the last batch.'''
+        if not self.ready.is_set():
+            return 'restarting'
+        # The executor's management thread marks it broken as soon as a worker exits
+        return 'broken' if getattr(self.pool, '_broken', False) else 'ready'
+
+    def spawn(self, coroutine):
+        ''' Run coroutine as a task, holding a reference until it finishes.'''
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def stop(self):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+        for task in list(self.tasks):
+            task.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    def submit(self, puzzle_strings):
+        ''' Queue puzzles, returning a future per puzzle. Raise Overloaded if they do not all fit.'''
+        if self.queue.maxsize - self.queue.qsize() < len(puzzle_strings):
+            raise Overloaded()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for puzzle_string in puzzle_strings:
+            future = loop.create_future()
+            self.queue.put_nowait((puzzle_string, future))
+            futures.append(future)
+        return futures
+
+    async def dispatch(self):
+        ''' Take batches off the queue and send them to the pool.'''
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch)<self.batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+
+            # Skip puzzles whose request has already timed out
+            batch = [(puzzle_string, future) for puzzle_string, future in batch if not future.done()]
+            if batch:
+                await self.inflight.acquire()
+                self.spawn(self.run_batch(batch))
+
+    async def run_batch(self, batch):
+        ''' Solve a batch in the pool and resolve its futures, replacing the pool if a worker died.'''
+        loop = asyncio.get_running_loop()
+        try:
+            await self.ready.wait()
+            pool = self.pool
+            lines = await loop.run_in_executor(pool, solve_lines, [puzzle_string for puzzle_string, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            if isinstance(error, BrokenProcessPool):
+                self.spawn(self.replace_pool(pool))
+        else:
+            for (_, future), line in zip(batch, lines):
+                if not future.done():
+                    solution, status = line.split('\t')
+                    future.set_result({'solution': solution, 'status': status})
+        finally:
+            self.inflight.release()
+
+
+class SolveService:
+    ''' Minimal HTTP/1.1 front end for a BatchSolver, with keep-alive.'''
+
+    def __init__(self, solver, timeout=5.0, max_puzzles=1024, max_body=1<<20):
+        self.solver = solver
+        self.timeout = timeout
+        self.max_puzzles = max_puzzles
+        self.max_body = max_body
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length>self.max_body:
+                    await self.respond(writer, 413, {'error': 'request body too large'}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self.route(method, path, body)
+                close = headers.get('connection', '').lower()=='close'
+                await self.respond(writer, status, payload, close)
+                if close:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        ''' Return (HTTP status, JSON payload) for a request; any failure is a 500.'''
+        try:
+            if method=='GET' and path=='/health':
+                return self.health()
+            if method!='POST' or path!='/solve':
+                return 404, {'error': 'use POST /solve or GET /health'}
+            return await self.solve(body)
+        except Exception as error:
+            return 500, {'error': f'{type(error).__name__}: {error}'}
+
+    def health(self):
+        ''' Return (HTTP status, JSON payload) for the pool's state, starting a replacement if it is broken.'''
+        state = self.solver.pool_state()
+        if state=='broken':
+            self.solver.spawn(self.solver.replace_pool(self.solver.pool))
+        payload = {'ok': state=='ready', 'pool': state, 'pending': self.solver.queue.qsize(),
+                   'workers': self.solver.workers, 'restarts': self.solver.restarts}
+        return 200 if state=='ready' else 503, payload
+
+    async def solve(self, body):
+        ''' Return (HTTP status, JSON payload) for a POST /solve body.'''
+        try:
+            request = json.loads(body)
+            single = 'puzzle' in request
+            puzzle_strings = [request['puzzle']] if single else list(request['puzzles'])
+            if not all(isinstance(puzzle_string, str) for puzzle_string in puzzle_strings):
+                raise TypeError()
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'expected {"puzzle": "..."} or {"puzzles": ["...", ...]}'}
+        if len(puzzle_strings)>self.max_puzzles:
+            return 413, {'error': f'at most {self.max_puzzles} puzzles per request'}
+
+        try:
+            futures = self.solver.submit(puzzle_strings)
+        except Overloaded:
+            return 503, {'error': 'overloaded, retry later'}
+        try:
+            results = await asyncio.wait_for(asyncio.gather(*futures), self.timeout)
+        except asyncio.TimeoutError:
+            for future in futures:
+                future.cancel()
+            return 504, {'error': f'not solved within {self.timeout}s'}
+        return 200, results[0] if single else {'results': results}
+
+    async def respond(self, writer, status, payload, close=False):
+        body = json.dumps(payload).encode()
+        head = (f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: {"close" if close else "keep-alive"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(host='127.0.0.1', port=8080, unix=None, workers=None, batch_size=32, batch_delay=0.002,
+                max_pending=4096, timeout=5.0):
+    ''' Run the service until cancelled.'''
+    solver = BatchSolver(workers, batch_size, batch_delay, max_pending)
+    await solver.start()
+    service = SolveService(solver, timeout)
+    if unix:
+        server = await asyncio.start_unix_server(service.handle_connection, path=unix)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Serving on {unix or f'http://{host}:{port}'} with {solver.workers} workers", flush=True)
+
+    # Shut down cleanly on SIGINT or SIGTERM
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, stopping.set)
+    try:
+        async with server:
+            await stopping.wait()
+    finally:
+        await solver.stop()
+        if unix:
+            with contextlib.suppress(OSError):
+                os.unlink(unix)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve sudoku solving over local HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix', default=None, help='listen on this Unix socket path instead of TCP')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--batch-size', type=int, default=32, help='maximum puzzles per batch')
+    parser.add_argument('--batch-delay', type=float, default=0.002, help='seconds to wait for a batch to fill')
+    parser.add_argument('--max-pending', type=int, default=4096, help='puzzles queued before new requests get 503')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds before a request gets 504')
+    args = parser.parse_args(argv)
+
+    asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.batch_size, args.batch_delay,
+                      args.max_pending, args.timeout))
+    return
+
+
+if __name__ == '__main__':
+    main()
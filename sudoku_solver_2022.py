@@ -3,6 +3,7 @@
 
 import numpy as np
 import itertools
+from utils import get_box, UNIT_CELL_MAPS
 
 ## To do
 # When you have boolean for rows and cols, use np.outer to create array of booleans.
@@ -35,9 +36,7 @@ class SudokuSolver:
                 
             # Check boxes for multiples
             for ibox in np.arange(9):
-                irow = 3 * (ibox//3)
-                icol = 3 * (ibox%3)
-                if int_solved[irow:irow+3,icol:icol+3].sum()>1:
+                if int_solved[get_box(ibox)].sum()>1:
                     print(f'Multiple of {integer} in box {ibox+1} ')
                     self.print_sudoku()
                     return True
@@ -128,24 +127,22 @@ class SudokuSolver:
         # Check for pairs by row
         for irow in np.arange(9):
             array = self.pmarks[:,irow,:]
-            cell_map = np.stack( (np.full(9,irow), np.arange(9)), axis=1)
+            cell_map = UNIT_CELL_MAPS[irow]
             self.check_hiddenpairs( array, cell_map )
             self.check_nakedpairs( array, cell_map )
             
         # Check for pairs by column
         for icol in np.arange(9):
             array = self.pmarks[:,:,icol]
-            cell_map = np.stack( (np.arange(9), np.full(9,icol)), axis=1)
+            cell_map = UNIT_CELL_MAPS[9+icol]
             self.check_hiddenpairs( array, cell_map )
             self.check_nakedpairs( array, cell_map )
         
         
         # Check for pairs by box
         for ibox in np.arange(9):
-            irow = 3 * (ibox//3)
-            icol = 3 * (ibox%3)
-            array = self.pmarks[:,irow:irow+3,icol:icol+3].reshape(9,9)
-            cell_map = np.stack( (irow+np.arange(9)//3, icol+np.arange(9)%3), axis=1)
+            array = self.pmarks[(slice(None),)+get_box(ibox)].reshape(9,9)
+            cell_map = UNIT_CELL_MAPS[18+ibox]
             self.check_hiddenpairs( array, cell_map)
             self.check_nakedpairs( array, cell_map)
 
@@ -159,7 +156,7 @@ class SudokuSolver:
         # Check for pairs by row
         for irow in np.arange(9):
             array = self.pmarks[:,irow,:]
-            cell_map = np.stack( (np.full(9,irow), np.arange(9)), axis=1)
+            cell_map = UNIT_CELL_MAPS[irow]
             self.check_hiddenpairs( array, cell_map,3 )
             self.check_nakedpairs( array, cell_map,3 )
             self.check_hiddenpairs( array, cell_map,4 )
@@ -168,7 +165,7 @@ class SudokuSolver:
         # Check for pairs by column
         for icol in np.arange(9):
             array = self.pmarks[:,:,icol]
-            cell_map = np.stack( (np.arange(9), np.full(9,icol)), axis=1)
+            cell_map = UNIT_CELL_MAPS[9+icol]
             self.check_hiddenpairs( array, cell_map, 3 )
             self.check_nakedpairs( array, cell_map, 3)
             self.check_hiddenpairs( array, cell_map, 4 )
@@ -176,10 +173,8 @@ class SudokuSolver:
         
         # Check for pairs by box
         for ibox in np.arange(9):
-            irow = 3 * (ibox//3)
-            icol = 3 * (ibox%3)
-            array = self.pmarks[:,irow:irow+3,icol:icol+3].reshape(9,9)
-            cell_map = np.stack( (irow+np.arange(9)//3, icol+np.arange(9)%3), axis=1)
+            array = self.pmarks[(slice(None),)+get_box(ibox)].reshape(9,9)
+            cell_map = UNIT_CELL_MAPS[18+ibox]
             self.check_hiddenpairs( array, cell_map, 3 )
             self.check_nakedpairs( array, cell_map, 3)
             self.check_hiddenpairs( array, cell_map, 4 )
@@ -194,8 +189,8 @@ class SudokuSolver:
         return
     
     def check_hiddenpairs(self, array, cell_map, N=2):
-        ''' N numbers only appear in N cells. Remove other pencilmarks in those cells. '''
-        # Currently coded for N=2.
+        ''' N numbers only appear in the same N cells. Remove other pencilmarks in those cells. '''
+        # Only numbers with exactly N possible cells are considered, so N=2 finds hidden pairs, 3 triples and 4 quads.
         int_counts = array.sum(axis=1)
         candidate_ints = np.arange(9)[int_counts==N]+1
         
@@ -212,13 +207,13 @@ class SudokuSolver:
                     #print(f'Found hidden pair of {subset} in cells {cell_map[array[subset[0]],:]+1}')
                         
     def check_nakedpairs(self, array, cell_map, N=2):
-        ''' The only pencilmarks in two cells are two numbers. Remove those two numbers from other cells. '''
-        # Currently coded for N=2.
+        ''' The only pencilmarks in N cells are the same N numbers. Remove those N numbers from other cells. '''
+        # Only cells with exactly N pencilmarks are considered, so N=2 finds naked pairs, 3 triples and 4 quads.
         cells = (array.sum(axis=0)==N)
         candidate_cells = np.arange(9)[cells]
         
         # Check if only N ints appear in N cells.
-        for Ncells in itertools.combinations(candidate_cells, 2):
+        for Ncells in itertools.combinations(candidate_cells, N):
             if np.isin( array[:,Ncells].sum(axis=1), [0,N]).all():
         
                 # Remove the naked integers from all other cells
@@ -296,7 +291,7 @@ class SudokuSolver:
             for irow, icol in zip(*np.where(int_solved)):
                 self.pmarks[integer-1,irow,:] = False
                 self.pmarks[integer-1,:,icol] = False
-                self.pmarks[integer-1,3*(irow//3):3*(irow//3+1),3*(icol//3):3*(icol//3+1)] = False
+                self.pmarks[(integer-1,)+get_box(3*(irow//3)+icol//3)] = False
             
         self.pmarks[:,self.puzzle>0]=False
         
@@ -320,7 +315,7 @@ class SudokuSolver:
             for irow, icol in zip(*np.where(int_solved)):
                 self.pmarks[integer-1,irow,:] = False
                 self.pmarks[integer-1,:,icol] = False
-                self.pmarks[integer-1,3*(irow//3):3*(irow//3+1),3*(icol//3):3*(icol//3+1)] = False
+                self.pmarks[(integer-1,)+get_box(3*(irow//3)+icol//3)] = False
                     
         return
     
@@ -328,18 +323,17 @@ class SudokuSolver:
         ''' Find pointing_pairs in cells and remove the corresponding pencil marks.'''
         for integer in np.arange(9)+1:
             for ibox in np.arange(9):
-                irow = 3 * (ibox//3)
-                icol = 3 * (ibox%3)
+                box_mask, irow, icol = get_box(ibox, with_offset=True)
     
                 # Check if all trues are in same column
-                cols_any = self.pmarks[integer-1,irow:irow+3, icol:icol+3].any(axis=0)
+                cols_any = self.pmarks[integer-1][box_mask].any(axis=0)
                 if cols_any.sum()==1:
                     true_col = cols_any.argmax()
                     rows = np.isin( np.arange(9), np.arange(irow,irow+3), invert=True)
                     self.pmarks[integer-1,rows, icol+true_col] = False
         
                 # Check if all trues are in same row
-                rows_any = self.pmarks[integer-1,irow:irow+3, icol:icol+3].any(axis=1)
+                rows_any = self.pmarks[integer-1][box_mask].any(axis=1)
                 if rows_any.sum()==1:
                     true_row = rows_any.argmax()
                     cols = np.isin( np.arange(9), np.arange(icol,icol+3), invert=True)
@@ -364,9 +358,7 @@ class SudokuSolver:
                     
             # Check if only one possible location in box
             for ibox in np.arange(9):
-                irow = 3*(ibox//3)
-                icol = 3*(ibox%3)
-                box_slice = np.s_[irow:irow+3, icol:icol+3]
+                box_slice = get_box(ibox)
                 box_poss = int_poss[box_slice].copy()
                 if np.sum(box_poss)==1:
                     self.puzzle[box_slice][box_poss] = integer+1
@@ -380,42 +372,49 @@ class SudokuSolver:
        
 
 
-hard = '400008060-700020105-000061070-150030400-000745000-200006000-070084030-800200000-509000020'
-solver = SudokuSolver(hard)
+def solve_puzzle(puzzle_string):
+    ''' Run the solving loop on puzzle_string and return the finished solver.'''
+    solver = SudokuSolver(puzzle_string)
 
+    while not solver.finished:
+        # Print current solution
+        print(f'Iteration={solver.iteration}, {solver.unknowns} unknowns left, {solver.tot_pmarks} pencil marks left...')
+        solver.print_sudoku()
+        solver.increment()
 
-while not solver.finished:
-    # Print current solution
-    print(f'Iteration={solver.iteration}, {solver.unknowns} unknowns left, {solver.tot_pmarks} pencil marks left...')
-    solver.print_sudoku()
-    solver.increment()
-
-    # Check for inconsistencies
-    if solver.check_errors():
-        solver.finished = True
-        continue
+        # Check for inconsistencies
+        if solver.check_errors():
+            solver.finished = True
+            continue
     
-    solver.update_pmarks()
-    solver.find_solutions()
+        solver.update_pmarks()
+        solver.find_solutions()
 
-    # Find current unknowns
-    current_unknowns = np.sum(solver.puzzle==0)
-    current_tot_pmarks = solver.pmarks.sum()
+        # Find current unknowns
+        current_unknowns = np.sum(solver.puzzle==0)
+        current_tot_pmarks = solver.pmarks.sum()
     
-    # Break conditions
-    if current_tot_pmarks == solver.tot_pmarks:
-        # If stuck, try guess_and_check
-        solver.guess_and_check()
-        solver.expert_checks()
-        if current_tot_pmarks == solver.pmarks.sum():
-            print(f"Can't find solution. {solver.unknowns} unknowns left, {solver.tot_pmarks} pencil marks left...")
-            solver.report_pmarks()
+        # Break conditions
+        if current_tot_pmarks == solver.tot_pmarks:
+            # If stuck, try guess_and_check
+            solver.guess_and_check()
+            solver.expert_checks()
+            if current_tot_pmarks == solver.pmarks.sum():
+                print(f"Can't find solution. {solver.unknowns} unknowns left, {solver.tot_pmarks} pencil marks left...")
+                solver.report_pmarks()
+                solver.finished = True
+
+        elif current_unknowns==0:
+            print('Solved!')
+            solver.print_sudoku()
             solver.finished = True
+        else:
+            solver.unknowns = current_unknowns
+            solver.tot_pmarks = current_tot_pmarks
 
-    elif current_unknowns==0:
-        print('Solved!')
-        solver.print_sudoku()
-        solver.finished = True
-    else:
-        solver.unknowns = current_unknowns
-        solver.tot_pmarks = current_tot_pmarks
\ No newline at end of file
+    return solver
+
+
+if __name__ == '__main__':
+    hard = '400008060-700020105-000061070-150030400-000745000-200006000-070084030-800200000-509000020'
+    solve_puzzle(hard)
@@ -2,151 +2,702 @@
 # Python code to solve a sudoku puzzle
 
 import numpy as np
-import itertools
-from utils import get_box, check_errors, parse_input, display_sudoku
+import struct
+import time
+from array import array
+from collections import deque
+from functools import partial
+from itertools import repeat
+from utils import check_errors, parse_input, format_puzzle, display_sudoku, get_board
+from candidates import CandidateGrid, covering_subsets, mask_typecode
+from profiling import TechniqueStats
 ## To do
 # When you have boolean for rows and cols, use np.outer to create array of booleans.
 #
 
+def unit_name(unit, size=9):
+    ''' Name of unit index (rows 0-8, columns 9-17, boxes 18-26 on a 9x9 board).'''
+    return f"{('row', 'column', 'box')[unit//size]} {unit%size+1}"
+
+def format_step(step, size=9):
+    ''' Render a (technique, integer, unit, cells) step tuple from a size x size board as a message.'''
+    technique, integer, unit, cells = step
+    if cells:
+        irow, icol = divmod(cells[0], size)
+    if technique=='box_single':
+        return f'Found {integer} in {unit_name(unit, size)} (only box position available)'
+    if technique in ('row_single', 'column_single'):
+        position = 'row' if technique=='row_single' else 'column'
+        return f'Found {integer} in row {irow+1}, column {icol+1} (only {position} position available)'
+    if technique=='naked_single':
+        return f'Found integer {integer} in row {irow+1}, column {icol+1} as the only valid integer.'
+    if technique=='guess':
+        return f'Guessing {integer} in row {irow+1}, column {icol+1}'
+    if technique=='hidden_subset':
+        return f'Found hidden subset of {integer} in {unit_name(unit, size)}'
+    if technique=='naked_subset':
+        return f'Found naked subset of {integer} in {unit_name(unit, size)}'
+    if technique=='pointing_pair':
+        return f'Applied pointing pair for {integer} in {unit_name(unit, size)}'
+    if technique=='cell_forcing':
+        return f"Cell forcing on {'/'.join(map(str, integer))} in row {irow+1}, column {icol+1} removed pmarks from {len(cells)-1} cells"
+    if technique in ('xwing', 'swordfish', 'jellyfish'):
+        return f"Applying {technique} for integer {integer} in {', '.join(unit_name(u, size) for u in unit)}"
+    return str(step)
+
+
 class SudokuSolver:
-    def __init__(self,puzzle_string):
+    ''' Solve a sudoku puzzle with logical techniques, falling back to search when stuck.
+
+    Set verbose=False to skip all printing. Pass a list (or any object with an
+    append method) as events to record each deduction as a compact
+    (technique, integer, unit, cells) tuple; render them later with format_step.
+    When events is a list (or a list subclass), steps made in search branches
+    that are later undone are deleted from it again.
+    Set profile=True to collect per-technique TechniqueStats in self.stats.
+    Set order=4 or 5 for 16x16 or 25x25 boards (see utils.parse_input).
+
+    techniques is a sequence of (name, function(solver)) in order of increasing
+    cost (default DEFAULT_TECHNIQUES). Singles and basic elimination always run
+    to fixpoint first; update_pmarks then escalates through techniques only
+    until one removes a pmark, and drops back to singles.
+
+    With solve=False only the givens are placed; steps() and next_hint() then
+    produce deductions one at a time.
+    '''
+    def __init__(self, puzzle_string, verbose=True, events=None, profile=False, techniques=None, executor=None, solve=True, order=3):
+        self.setup(verbose, events, profile, techniques, executor, order)
+        self.place_givens(parse_input(puzzle_string, order).ravel().tolist(), solve)
+        return
+
+    @classmethod
+    def from_values(cls, values, solve=True, **options):
+        ''' Build a solver from the given values, one per cell (0 for unknown), as __init__ does from a puzzle string.'''
+        solver = cls.__new__(cls)
+        solver.setup(**options)
+        solver.place_givens(values, solve)
+        return solver
+
+    def place_givens(self, values, solve=True):
+        ''' Place the given values, one per cell (0 for unknown), and propagate them only when solving right away.'''
+        for cell, value in enumerate(values):
+            if value:
+                self.place(cell, value-1)
+
+        if solve:
+            self.update_pmarks()
+            self.solve()
+
+    def setup(self, verbose=True, events=None, profile=False, techniques=None, executor=None, order=3):
+        ''' Set reporting and technique options, and start from an empty puzzle.'''
+
+        # Setup reporting
+        self.verbose = verbose
+        self.events = events
+        self.reporting = verbose or events is not None
+        self.stats = TechniqueStats() if profile else None
+        self.techniques = DEFAULT_TECHNIQUES if techniques is None else techniques
+        self.executor = executor
 
         # Setup puzzle and pencil_marks arrays
         self.iteration = 0 
-        self.puzzle = parse_input(puzzle_string)
-        self.pmarks = np.full((9,9,9), True)
-        self.update_pmarks()
-
-        # Main solving loop
+        self.status = 'unsolved'
+        self.order = order
+        self.board = get_board(order)
+        self.values = [0]*self.board.ncells
+        self.candidates = CandidateGrid(order=order)
+        self.tables = self.candidates.tables
+        self.unit_solved = array(self.candidates.typecode, [0]*len(self.board.units)) # bits of integers solved per unit
+        self.placements = [] # (cell, previous value, units where the integer was already solved), for undo
+        self.queue = deque()
+        self.contradiction = False
+
+    @classmethod
+    def from_state(cls, masks, values, **options):
+        ''' Build a solver from pmark masks and solved integers (0 for unknown) without solving it.'''
+        solver = cls.__new__(cls)
+        solver.setup(**options)
+        solver.candidates = CandidateGrid(masks, solver.order)
+        solver.values = list(values)
+        solver.count_solved()
+        return solver
+
+    def snapshot(self):
+        ''' Return the puzzle state in the compact format read by restore and state_view.
+
+        The format is a STATE_HEADER (magic, version, order, status, contradiction flag,
+        iteration), then the pmark masks (uint16, or uint32 for 25x25), then one byte per
+        cell value: 255 bytes for a 9x9 board. Propagation still queued is not kept; the
+        next round of singles finds it again from the masks.
+        '''
+        header = STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, self.order, STATUSES.index(self.status),
+                                   self.contradiction, self.iteration)
+        return header + self.candidates.masks.tobytes() + bytes(self.values)
+
+    def snapshot_into(self, buffer, offset=0):
+        ''' Write snapshot() into a writable buffer (e.g. shared memory) at offset. Return the bytes written.'''
+        state = self.snapshot()
+        memoryview(buffer)[offset:offset+len(state)] = state
+        return len(state)
+
+    @classmethod
+    def restore(cls, buffer, offset=0, **options):
+        ''' Build a solver, without solving it, from a snapshot in buffer (bytes, mmap, shared memory) at offset.
+
+        The board order comes from the snapshot; an order option must agree with it.
+        '''
+        order, status, contradiction, iteration, masks, values = state_view(buffer, offset)
+        if options.pop('order', order)!=order:
+            raise ValueError(f'Snapshot is of an order {order} board')
+        solver = cls.from_state(masks.tobytes(), values, order=order, **options)
+        solver.status = status
+        solver.contradiction = contradiction
+        solver.iteration = iteration
+        return solver
+
+    def solve(self):
+        ''' Main solving loop. Return the final status.'''
+        verbose = self.verbose
         stopFlag = False
         while not stopFlag:
-            self.print_sudoku()
-            
+            if verbose:
+                self.print_sudoku()
+
+            # Placements keep per-unit counters, so this is cheap enough to check every iteration
+            if self.has_contradiction():
+                self.status = 'unsolvable'
+                if verbose:
+                    check_errors(self.puzzle, pmarks=self.pmarks)
+                    print('ERROR!!! No solution exists.')
+                break
+
             state = self.identify_solutions() #'stuck', 'solved', or 'normal'
 
             # Break conditions
             if state=='solved':
-                self.print_sudoku()
-                print('Solved!')
+                self.status = 'solved'
                 stopFlag = True
 
             elif state=='stuck':
-                print('Stuck!!!')
+                if verbose:
+                    print('Stuck!!! Falling back to search...')
+                self.status = 'solved' if self.search() else 'unsolvable'
                 stopFlag = True
 
-            if check_errors(self.puzzle):
-                print('ERROR!!!')
-                break
-        return
-
+            if verbose:
+                if self.status=='solved':
+                    self.print_sudoku()
+                    print('Solved!')
+                elif self.status=='unsolvable':
+                    print('No solution exists.')
+        return self.status
+
+    def steps(self):
+        ''' Yield deductions one at a time as (technique, integer, unit, cells) step tuples.
+
+        Each round applies only the cheapest rule that makes progress (see apply_next)
+        and yields its steps, so stopping after the first step costs one rule
+        evaluation. Stops when the puzzle is solved, stuck or contradicted; search
+        is never used.
+        '''
+        while 0 in self.values and not self.has_contradiction():
+            found = self.apply_next()
+            if not found:
+                return
+            yield from found
+
+    def next_hint(self):
+        ''' Return the next deduction as a step tuple without changing the puzzle, or None if there is none.'''
+        start = self.checkpoint()
+        queue = list(self.queue)
+        step = next(self.steps(), None)
+        self.undo(start)
+        self.queue.extend(queue)
+        return step
+
+    def apply_next(self):
+        ''' Apply the cheapest rule that makes progress and return its steps (empty if none does).
+
+        Rules are tried in order: a naked single, a hidden single in a box, row or
+        column, then each of self.techniques, which runs over the whole board.
+        Steps are also passed on to self.events.
+        '''
+        masks = self.candidates.masks
+        values = self.values
+        popcount = self.tables.popcount
+        board = self.board
+        n = board.size
+
+        events, reporting = self.events, self.reporting
+        found = self.events = []
+        self.reporting = True
+        try:
+            # Naked single
+            for cell in range(len(values)):
+                if values[cell]==0 and popcount[masks[cell]]==1:
+                    integer = self.tables.lowest_bit[masks[cell]]
+                    self.place(cell, integer)
+                    self.report('naked_single', integer+1, None, (cell,))
+                    return found
+
+            # Hidden single, in boxes first as place_singles does
+            for technique, first, units in (('box_single', 2*n, board.boxes), ('row_single', 0, board.rows),
+                                            ('column_single', n, board.cols)):
+                for k, unit in enumerate(units):
+                    for integer, cell in self.find_unit_singles(unit):
+                        if values[cell]==0:
+                            self.place(cell, integer)
+                            self.report(technique, integer+1, first+k, (cell,))
+                            return found
+
+            # Techniques in order of increasing cost, stopping at the first that removes pmarks
+            initial_pmarks = self.candidates.count()
+            for name, technique in self.techniques:
+                self.run_technique(name, technique, self)
+                if self.candidates.count()!=initial_pmarks:
+                    break
+            return found
+        finally:
+            self.events, self.reporting = events, reporting
+            if events is not None:
+                for step in found:
+                    events.append(step)
+
+    def report(self, technique, integer, unit, cells):
+        ''' Record a deduction as a step tuple and print it if verbose.'''
+        step = (technique, integer, unit, cells)
+        if self.events is not None:
+            self.events.append(step)
+        if self.verbose:
+            print(format_step(step, self.board.size))
+
+    def run_technique(self, name, technique, *args):
+        ''' Run technique(*args), recording time and pmarks removed when profiling.'''
+        if self.stats is None:
+            technique(*args)
+            return
+
+        initial_pmarks = self.candidates.count()
+        start = time.perf_counter()
+        technique(*args)
+        self.stats.record(name, time.perf_counter()-start, initial_pmarks-self.candidates.count())
+
+    @property
+    def puzzle(self):
+        ''' Solved integers as a (size,size) array, 0 for unknown cells.'''
+        return np.array(self.values).reshape(self.board.size, self.board.size)
+
+    @property
+    def pmarks(self):
+        ''' Pencil marks as a (size,size,size) boolean array indexed [integer, row, col].'''
+        return self.candidates.to_pmarks()
+
+    def find_unit_singles(self, unit):
+        ''' Return (integer, cell) pairs for integers with only one possible cell in unit.'''
+        masks = self.candidates.masks
+
+        # Integers seen exactly once across the unit
+        once, twice = 0, 0
+        for cell in unit:
+            twice |= once & masks[cell]
+            once |= masks[cell]
+
+        singles = []
+        for integer in self.tables.mask_digits[once & ~twice]:
+            bit = 1<<integer
+            for cell in unit:
+                if masks[cell] & bit:
+                    singles.append((integer, cell))
+                    break
+        return singles
 
     def identify_solutions(self):
-        '''Check for singular integer solutions over boxes, rows, and columns.'''
-        # Singleint Solutions
-        for integer in range(9):
-            int_poss = self.pmarks[integer, :, :]
-            
-            # Check if only one possible location in box
-            for ibox in range(9):
-                box_mask = get_box(ibox)
-                mask = int_poss[box_mask]
-                if np.sum(mask)==1:
-                    if self.puzzle[box_mask][mask]==0:
-                        self.puzzle[box_mask][mask] = integer+1
-                        print(f'Found {integer+1} in box {ibox+1} (only box position available)')
-
-
-            # Check if only one possible location in column/row (only print if previously unsolved)
-            for irow in range(9):
-                mask = int_poss[irow,:]
-                if np.sum(mask)==1:
-                    if self.puzzle[irow, mask]==0:
-                        self.puzzle[irow, mask]= integer+1
-                        print(f'Found {integer+1} in row {irow+1}, column {mask.argmax()+1} (only row position available)')
-
-                    
-            for icol in range(9):
-                mask = int_poss[:,icol]
-                if np.sum(mask)==1:
-                    if self.puzzle[mask, icol]==0:
-                        self.puzzle[mask, icol] = integer+1  
-                        print(f'Found {integer+1} in row {mask.argmax()+1}, column {icol+1} (only column position available)')
-                    
+        '''Place singles, then update pmarks. Return 'solved', 'stuck' or 'normal'.'''
+        values = self.values
+        initial_unknowns = values.count(0)
+        self.run_technique('singles', self.place_singles)
 
-        
-        # Multiint Solutions
-        for irow, icol in zip(*np.where(self.pmarks.sum(axis=0)==1)):
-            integer = self.pmarks[:, irow, icol].argmax()
-            if self.puzzle[irow, icol] == 0:
-                self.puzzle[irow, icol] = integer + 1
-                print(f'Found integer {integer+1} in row {irow+1}, column {icol+1} as the only valid integer.')
-            
-        if np.sum(self.puzzle==0)==0:
+        if 0 not in values:
             return 'solved'
         else:
             removed_pmarks = self.update_pmarks()
-            if removed_pmarks==0:
+            if removed_pmarks==0 and values.count(0)==initial_unknowns:
                 return 'stuck'
             else:
                 return 'normal'
-            
 
-    def apply_hiddenpairs(self):
-        ''' Check for hidden pairs, naked pairs.'''
-        
-        # Check for pairs by row
-        for irow in np.arange(9):
-            array = self.pmarks[:,irow,:]
-            cell_map = np.stack( (np.full(9,irow), np.arange(9)), axis=1)
-            self.check_hiddenpairs( array, cell_map, f'row = {irow+1}', N=2)
-            self.check_hiddenpairs( array, cell_map, f'row = {irow+1}', N=3)
-            self.check_hiddenpairs( array, cell_map, f'row = {irow+1}', N=4)
-            
-        # Check for pairs by column
-        for icol in np.arange(9):
-            array = self.pmarks[:,:,icol]
-            cell_map = np.stack( (np.arange(9), np.full(9,icol)), axis=1)
-            self.check_hiddenpairs( array, cell_map, f'column = {icol+1}', N=2)
-            self.check_hiddenpairs( array, cell_map, f'column = {icol+1}', N=3)
-            self.check_hiddenpairs( array, cell_map, f'column = {icol+1}', N=4)
-        
-        
-        # Check for pairs by box
-        for ibox in np.arange(9):
-            irow = 3 * (ibox//3)
-            icol = 3 * (ibox%3)
-            array = self.pmarks[:,irow:irow+3,icol:icol+3].reshape(9,9)
-            cell_map = np.stack( (irow+np.arange(9)//3, icol+np.arange(9)%3), axis=1)
-            self.check_hiddenpairs( array, cell_map, f'box = {ibox+1}', N=2)
-            self.check_hiddenpairs( array, cell_map, f'box = {ibox+1}', N=3)
-            self.check_hiddenpairs( array, cell_map, f'box = {ibox+1}', N=4)
+    def place_singles(self):
+        '''Check for singular integer solutions over boxes, rows, and columns.'''
+        values = self.values
+        n = self.board.size
 
-    
-    def check_hiddenpairs(self, array, cell_map, label, N=2):
-        ''' N numbers only appear in N cells. Remove other pencilmarks in those cells. '''
+        # Singleint Solutions
+        for ibox, box in enumerate(self.board.boxes):
+            for integer, cell in self.find_unit_singles(box):
+                if values[cell]==0:
+                    self.place(cell, integer)
+                    if self.reporting:
+                        self.report('box_single', integer+1, 2*n+ibox, (cell,))
+                    self.propagate()
+
+        # Check if only one possible location in column/row (only print if previously unsolved)
+        for irow, row in enumerate(self.board.rows):
+            for integer, cell in self.find_unit_singles(row):
+                if values[cell]==0:
+                    self.place(cell, integer)
+                    if self.reporting:
+                        self.report('row_single', integer+1, irow, (cell,))
+                    self.propagate()
+
+        for icol, col in enumerate(self.board.cols):
+            for integer, cell in self.find_unit_singles(col):
+                if values[cell]==0:
+                    self.place(cell, integer)
+                    if self.reporting:
+                        self.report('column_single', integer+1, n+icol, (cell,))
+                    self.propagate()
+
+        # Multiint Solutions
+        masks = self.candidates.masks
+        popcount = self.tables.popcount
+        for cell in range(len(values)):
+            if popcount[masks[cell]]==1 and values[cell]==0:
+                integer = self.tables.lowest_bit[masks[cell]]
+                self.place(cell, integer)
+                if self.reporting:
+                    self.report('naked_single', integer+1, None, (cell,))
+                self.propagate()
+
+    def place(self, cell, integer):
+        ''' Solve cell as integer (0-based), remove integer from its peers and queue the cell for propagation.'''
+        masks = self.candidates.masks
+        bit = 1<<integer
+        if not masks[cell] & bit:
+            self.contradiction = True
+
+        # Solved integers per unit catch a repeat in O(1)
+        unit_solved = self.unit_solved
+        repeats = ()
+        for iunit in self.board.cell_units[cell]:
+            if unit_solved[iunit] & bit:
+                self.contradiction = True
+                repeats += (iunit,)
+            unit_solved[iunit] |= bit
+
+        self.placements.append((cell, self.values[cell], repeats))
+        self.values[cell] = integer+1
+        cleared = masks[cell] & ~(1<<integer)
+        self.candidates.touch(cell, masks[cell])
+        masks[cell] = 0
+        self.queue.append((cell, integer, cleared, self.candidates.clear_peers(cell, integer)))
+
+    def propagate(self):
+        ''' Place the singles created by queued placements until the queue is empty.
+
+        Each placement is processed once: peers that lost its integer are checked for a
+        naked single, and the units of those peers (and the integers cleared from the
+        placed cell) are checked for a hidden single. Stops early on a contradiction.
+        '''
+        masks = self.candidates.masks
+        values = self.values
+        queue = self.queue
+        popcount, lowest_bit, mask_digits = self.tables.popcount, self.tables.lowest_bit, self.tables.mask_digits
+        cell_units = self.board.cell_units
+        while queue and not self.contradiction:
+            cell, integer, cleared, peers = queue.popleft()
+
+            # Peers left with a single pmark (or none)
+            units = set()
+            for peer in peers:
+                if values[peer]==0:
+                    if popcount[masks[peer]]==1:
+                        single = lowest_bit[masks[peer]]
+                        self.place(peer, single)
+                        if self.reporting:
+                            self.report('naked_single', single+1, None, (peer,))
+                    elif masks[peer]==0:
+                        self.contradiction = True
+                units.update(cell_units[peer])
+
+            # Units where integer (or one of the cleared integers) may now have one place left
+            for iunit in units:
+                self.place_hidden_single(iunit, integer)
+            for other in mask_digits[cleared]:
+                for iunit in cell_units[cell]:
+                    self.place_hidden_single(iunit, other)
+        return
+
+    def place_hidden_single(self, iunit, integer):
+        ''' Place integer if it has exactly one possible cell left in unit iunit; flag a contradiction if it has none.'''
+        masks = self.candidates.masks
+        bit = 1<<integer
+        found = -1
+        for cell in self.board.units[iunit]:
+            if masks[cell] & bit:
+                if found>=0:
+                    return
+                found = cell
+        if found>=0:
+            self.place(found, integer)
+            if self.reporting:
+                self.report(('row_single', 'column_single', 'box_single')[iunit//self.board.size], integer+1, iunit, (found,))
+        elif not self.unit_solved[iunit] & bit:
+            self.contradiction = True
+
+
+    def propagate_singles(self):
+        ''' Place singles until none are left or a contradiction is found.'''
+        unknowns = -1
+        while unknowns!=self.values.count(0) and not self.contradiction:
+            unknowns = self.values.count(0)
+            self.place_singles()
+
+    def apply_cell_forcing(self, max_candidates=2):
+        ''' Try each pmark of cells with up to max_candidates pmarks and keep what every outcome agrees on.
+
+        A pmark whose hypothesis leads to a contradiction is removed; pmarks removed in
+        every other outcome are removed too. Hypotheses are propagated with singles only,
+        in self.executor when one is set.
+        '''
+        masks = self.candidates.masks
+        values = self.values
+        popcount, mask_digits = self.tables.popcount, self.tables.mask_digits
+        initial_masks = masks[:]
+        cells = [cell for cell in range(len(values)) if values[cell]==0 and 2<=popcount[masks[cell]]<=max_candidates]
+        if not cells:
+            return
+
+        hypotheses = [(cell, integer) for cell in cells for integer in mask_digits[masks[cell]]]
+        outcomes = self.evaluate_hypotheses(masks.tobytes() + bytes(values), hypotheses)
+
+        for cell in cells:
+            integers = mask_digits[initial_masks[cell]]
+            results = [outcomes[(cell, integer)] for integer in integers]
+
+            # Pmarks whose hypothesis fails
+            failed = sum(1<<integer for integer, result in zip(integers, results) if result is None)
+            touched = [cell] if self.candidates.eliminate(cell, failed) else []
+            possible = [array(masks.typecode, result) for result in results if result is not None]
+            if not possible:
+                self.contradiction = True
+                return
+
+            # Pmarks removed in every surviving outcome
+            for other in range(len(values)):
+                if values[other]==0 and other!=cell:
+                    common = initial_masks[other]
+                    for result in possible:
+                        common &= ~result[other]
+                    if common and self.candidates.eliminate(other, common):
+                        touched.append(other)
+
+            if touched and self.reporting:
+                self.report('cell_forcing', tuple(integer+1 for integer in integers), None, (cell,)+tuple(touched))
+        return
 
-        # Find integers with counts equal to N
-        int_counts = array.sum(axis=1)
-        candidate_ints = np.arange(9)[int_counts==N]+1
+    def evaluate_hypotheses(self, state, hypotheses):
+        ''' Return {(cell, integer): outcome} for hypotheses on state.'''
+        if self.executor is None:
+            results = [evaluate_hypothesis(state, cell, integer, self.order) for cell, integer in hypotheses]
+        else:
+            cells, integers = zip(*hypotheses)
+            results = self.executor.map(evaluate_hypothesis, repeat(state), cells, integers, repeat(self.order), chunksize=8)
+        return dict(zip(hypotheses, results))
+
+    def has_contradiction(self):
+        ''' Check for repeated integers in a unit, unsolved cells with no pmarks, or integers with no place left.'''
+        if self.contradiction:
+            return True
+
+        # Repeats were flagged on placement; check for empty cells and integers with no place
+        values = self.values
+        masks = self.candidates.masks
+        all_digits = self.tables.all_digits
+        for unit, solved in zip(self.board.units, self.unit_solved):
+            possible = solved
+            for cell in unit:
+                if masks[cell]==0 and values[cell]==0:
+                    return True
+                possible |= masks[cell]
+            if possible != all_digits:
+                return True
+        return False
+
+    def count_solved(self):
+        ''' Recount the integers solved in each unit from the values, flagging a contradiction on repeats.'''
+        unit_solved = self.unit_solved
+        cell_units = self.board.cell_units
+        for iunit in range(len(unit_solved)):
+            unit_solved[iunit] = 0
+        for cell, value in enumerate(self.values):
+            if value:
+                bit = 1<<(value-1)
+                for iunit in cell_units[cell]:
+                    if unit_solved[iunit] & bit:
+                        self.contradiction = True
+                    unit_solved[iunit] |= bit
+
+    def search(self):
+        ''' Depth-first search from the current pmarks. Return True if solved, False if no solution exists.
+
+        On failure the puzzle and pmarks are undone to their state on entry.
+        '''
+        start = self.checkpoint()
+
+        # Propagate until solved, stuck or contradicted
+        state = 'normal'
+        while state=='normal':
+            state = self.identify_solutions()
+            if self.has_contradiction():
+                state = 'contradiction'
+        if state=='solved':
+            return True
+
+        if state=='stuck':
+            # Try each integer of the branch cell from the propagated state
+            cell = self.branch_cell()
+            branch = self.checkpoint()
+            for integer in self.tables.mask_digits[self.candidates.masks[cell]]:
+                if self.reporting:
+                    self.report('guess', integer+1, None, (cell,))
+                self.place(cell, integer)
+                self.propagate()
+                if self.search():
+                    return True
+                self.undo(branch)
+
+        self.undo(start)
+        return False
+
+    def branch_cell(self):
+        ''' Return the unsolved cell with the fewest pmarks, the cheapest to branch on.'''
+        masks = self.candidates.masks
+        values = self.values
+        popcount = self.tables.popcount
+        return min((cell for cell in range(len(values)) if not values[cell]), key=lambda cell: popcount[masks[cell]])
+
+    def count_solutions(self, limit=2):
+        ''' Count solutions from the current pmarks, stopping once limit are found. The state is left unchanged.'''
+        reporting, self.reporting = self.reporting, False
+        start = self.checkpoint()
+        count = 0
+
+        self.propagate_singles()
+        if self.has_contradiction():
+            pass
+        elif 0 not in self.values:
+            count = 1
+        else:
+            cell = self.branch_cell()
+            propagated = self.checkpoint()
+            for integer in self.tables.mask_digits[self.candidates.masks[cell]]:
+                self.place(cell, integer)
+                self.propagate()
+                count += self.count_solutions(limit-count)
+                self.undo(propagated)
+                if count>=limit:
+                    break
+
+        self.undo(start)
+        self.reporting = reporting
+        return count
+
+    def checkpoint(self):
+        ''' Return a mark of the current state for undo. Costs nothing: no arrays are copied.'''
+        reported = len(self.events) if isinstance(self.events, list) else None
+        return len(self.candidates.trail), len(self.placements), self.contradiction, reported
+
+    def undo(self, checkpoint):
+        ''' Restore the state at checkpoint, in time proportional to the removals and placements made since.
+
+        Checkpoints must be undone in last-in first-out order, as in a depth-first search.
+        '''
+        mark, placed, contradiction, reported = checkpoint
+        self.candidates.undo(mark)
+
+        # Steps reported since are no longer part of the solution
+        if reported is not None and isinstance(self.events, list):
+            del self.events[reported:]
+
+        # Unsolve cells placed since, leaving unit bits that were set before them
+        values = self.values
+        unit_solved = self.unit_solved
+        cell_units = self.board.cell_units
+        placements = self.placements
+        for cell, previous, repeats in reversed(placements[placed:]):
+            bit = 1<<(values[cell]-1)
+            for iunit in cell_units[cell]:
+                if iunit not in repeats:
+                    unit_solved[iunit] &= ~bit
+            values[cell] = previous
+        del placements[placed:]
+
+        self.contradiction = contradiction
+        self.queue.clear()
+
+    def apply_hiddenpairs(self, N=None):
+        ''' Check for hidden subsets of size N (default 2, 3 and 4) in the rows, columns and boxes changed since the last check.'''
+        for size in ((2, 3, 4) if N is None else (N,)):
+
+            # Units are rows, columns then boxes
+            for iunit in self.candidates.changed_units(('hidden_subset', size)):
+                self.check_hiddenpairs(iunit, N=size)
+
+    def apply_nakedpairs(self, N=None):
+        ''' Check for naked subsets of size N (default 2, 3 and 4) in the rows, columns and boxes changed since the last check.'''
+        for size in ((2, 3, 4) if N is None else (N,)):
+            for iunit in self.candidates.changed_units(('naked_subset', size)):
+                self.check_nakedpairs(iunit, N=size)
+    
+    def check_hiddenpairs(self, iunit, N=2):
+        ''' N numbers only appear in N cells of unit iunit. Remove other pencilmarks in those cells. '''
+        masks = self.candidates.masks
+        popcount, mask_digits = self.tables.popcount, self.tables.mask_digits
+        unit = self.board.units[iunit]
+
+        # Bitmask of the unit positions where each integer is possible
+        positions = [0]*len(unit)
+        for k, cell in enumerate(unit):
+            for integer in mask_digits[masks[cell]]:
+                positions[integer] |= 1<<k
+
+        # Integers with 2 to N possible cells can be part of a hidden subset
+        candidate_ints = [(integer, pos) for integer, pos in enumerate(positions) if 2<=popcount[pos]<=N]
         
-        # Check subsets of candidates for cell equality
-        for Nints in itertools.combinations(candidate_ints, N):
-            if np.isin( array[np.array(Nints)-1,:].sum(axis=0), [0,N]).all():
-
-                # Remove all other pencilmarks
-                cells = cell_map[array[Nints[0]-1],:]
-                for irow, icol in cells:
-                    self.pmarks[:,irow,icol] = False
-                    self.pmarks[np.array(Nints)-1,irow,icol] = True
-
-                print(f'Found hidden subset of {Nints} in {label}')
-                        
+        # Check subsets of candidates whose cells combined number N
+        for Nints, cells in covering_subsets(candidate_ints, N, popcount=popcount):
+
+            # Remove all other pencilmarks
+            bits = sum(1<<integer for integer in Nints)
+            touched = tuple(unit[k] for k in mask_digits[cells] if self.candidates.restrict(unit[k], bits))
+
+            if touched and self.reporting:
+                self.report('hidden_subset', tuple(integer+1 for integer in Nints), iunit, touched)
+
+    def check_nakedpairs(self, iunit, N=2):
+        ''' N cells of unit iunit only hold N numbers. Remove those numbers from the other cells. '''
+        masks = self.candidates.masks
+        popcount = self.tables.popcount
+        unit = self.board.units[iunit]
+
+        # Cells with 2 to N pencilmarks can be part of a naked subset
+        candidate_cells = [(cell, masks[cell]) for cell in unit if 2<=popcount[masks[cell]]<=N]
+
+        # Check subsets of cells whose pencilmarks combined number N
+        for Ncells, bits in covering_subsets(candidate_cells, N, popcount=popcount):
+
+            # Remove the naked integers from all other cells
+            touched = tuple(cell for cell in unit if cell not in Ncells and self.candidates.eliminate(cell, bits))
+
+            if touched and self.reporting:
+                self.report('naked_subset', tuple(integer+1 for integer in self.tables.mask_digits[bits]), iunit, touched)
+
     def print_sudoku(self):
         ''' Print array with sudoku formatting.'''
 
         # Header
-        unknowns = np.sum(self.puzzle==0)
-        tot_pmarks = self.pmarks.sum()
+        unknowns = self.values.count(0)
+        tot_pmarks = self.candidates.count()
         print(f'Iteration={self.iteration}, {unknowns} unknowns left, {tot_pmarks} pencil marks left...\n')
 
         display_sudoku(self.puzzle)
@@ -154,113 +705,206 @@ class SudokuSolver:
         return 
 
     def update_pmarks(self):
+        ''' Propagate new solutions, then escalate through techniques until one removes pmarks.'''
 
         # Note initial pmarks
-        initial_pmarks = self.pmarks.sum()   
-
-        # Remove all pmarks at solved cells
-        self.pmarks[:,self.puzzle>0]=False
-
-        # Remove pmarks in same row/col as solutions
-        for integer in range(9):
-            int_solved = self.puzzle==(integer+1)
-            for irow, icol in zip(*np.where(int_solved)):
-                self.pmarks[integer,irow,:] = False
-                self.pmarks[integer,:,icol] = False
-                self.pmarks[integer,3*(irow//3):3*(irow//3+1),3*(icol//3):3*(icol//3+1)] = False
-            
-        # Remove pmarks using pointing pairs
-        self.apply_pointing_pairs()
-
-        # Remove pmarks using hidden pairs (or higher order subsets)
-        self.apply_hiddenpairs()
-
-        # Apply xwing
-        self.apply_xwing()
+        initial_pmarks = self.candidates.count()
+
+        # Propagate new solutions to pmarks in the same row/col/box
+        self.run_technique('propagate', self.propagate)
+
+        # Only escalate when the cheap tier has stalled; stop at the first technique that makes progress
+        if self.candidates.count()==initial_pmarks:
+            for name, technique in self.techniques:
+                self.run_technique(name, technique, self)
+                if self.candidates.count()!=initial_pmarks:
+                    break
                 
         # Return number of pmarks removed
-        final_pmarks = self.pmarks.sum()
+        final_pmarks = self.candidates.count()
         return initial_pmarks - final_pmarks
         
     def apply_pointing_pairs(self):
-        ''' Find pointing_pairs in cells and remove the corresponding pencil marks.'''
-        for integer in np.arange(9):
-            for ibox in range(9):
-                box_mask, irow_0, icol_0 = get_box(ibox, with_offset=True)
-                box_pmarks = self.pmarks[integer][box_mask].sum()
-
-                # Check if pmarks are all in same column
-                cols_any = self.pmarks[integer][box_mask].any(axis=0)
-                if box_pmarks>1 and cols_any.sum()==1:
-                    icol = icol_0 + cols_any.argmax()
-                    irows = np.s_[irow_0:irow_0+3]
-
-                    # Check if pmarks would be removed by pointing pair
-                    if self.pmarks[integer, :, icol].sum()!=self.pmarks[integer, irows, icol].sum():
-                        print(f'Applied pointing pair for {integer+1} in box {ibox+1}')
-
-                        # Remove all pmarks in col, then add back the pointing pmarks
-                        temp_pmark_col = self.pmarks[integer, irows, icol].copy()
-                        self.pmarks[integer, :, icol] = False
-                        self.pmarks[integer, irows, icol] = temp_pmark_col
-
-
-                # Check if pmarks are all in same column
-                rows_any = self.pmarks[integer][box_mask].any(axis=1)
-                if box_pmarks>1 and rows_any.sum()==1:
-                    irow = irow_0 + rows_any.argmax()
-                    icols = np.s_[icol_0:icol_0+3]
-
-                    # Check if pmarks would be removed by pointing pair
-                    if self.pmarks[integer, irow, :].sum()!=self.pmarks[integer, irow, icols].sum():
-                        print(f'Applied pointing pair for {integer + 1} in box {ibox+1}')
-
-                        # Remove all pmarks in row, then add back the pointing pmarks
-                        temp_pmark_row = self.pmarks[integer, irow, icols].copy()
-                        self.pmarks[integer, irow, :] = False
-                        self.pmarks[integer, irow, icols] = temp_pmark_row
+        ''' Find pointing_pairs in the boxes changed since the last check and remove the corresponding pencil marks.'''
+        masks = self.candidates.masks
+        board = self.board
+        order = board.order
+        first = 2*board.size
+        for iunit in self.candidates.changed_units('pointing_pair'):
+            if iunit<first:
+                continue
+            ibox = iunit - first
+            box = board.boxes[ibox]
+
+            # Combined pmarks along each row and column of the box, and those seen in more than one
+            row_masks, col_masks = [0]*order, [0]*order
+            for k, cell in enumerate(box):
+                row_masks[k//order] |= masks[cell]
+                col_masks[k%order] |= masks[cell]
+            row_seen, row_repeated, col_seen, col_repeated = 0, 0, 0, 0
+            for k in range(order):
+                row_repeated |= row_seen & row_masks[k]
+                row_seen |= row_masks[k]
+                col_repeated |= col_seen & col_masks[k]
+                col_seen |= col_masks[k]
+
+            for k in range(order):
+                # Check if pmarks are all in same row, then remove from rest of row
+                only_row = row_masks[k] & ~row_repeated
+                if only_row:
+                    self.remove_pointing(ibox, board.rows[board.cell_row[box[order*k]]], only_row)
+
+                # Check if pmarks are all in same column, then remove from rest of column
+                only_col = col_masks[k] & ~col_repeated
+                if only_col:
+                    self.remove_pointing(ibox, board.cols[board.cell_col[box[k]]], only_col)
 
         return
-          
+
+    def remove_pointing(self, ibox, line, bits):
+        ''' Remove bits from the cells of line outside box ibox.'''
+        masks = self.candidates.masks
+        cell_box = self.board.cell_box
+        removed = 0
+        touched = [] # (cell, bits removed from it)
+        for cell in line:
+            if cell_box[cell]!=ibox and masks[cell] & bits:
+                touched.append((cell, masks[cell] & bits))
+                removed |= masks[cell] & bits
+                self.candidates.eliminate(cell, bits)
+
+        if removed and self.reporting:
+            for integer in self.tables.mask_digits[removed]:
+                cells = tuple(cell for cell, cleared in touched if cleared & 1<<integer)
+                self.report('pointing_pair', integer+1, 2*self.board.size+ibox, cells)
+
     def apply_xwing(self):
-        ''' Apply checks for Xwing and (in future) Swordfish '''
-        for integer in np.arange(9)+1:
-            array = self.pmarks[integer-1,:,:]
-            
-            # Check rows against rows
-            candidate_rows = np.arange(9)[array.sum(axis=1)==2] #get rows with 2 possible
-            if len(candidate_rows)>2:
-                pass
-            
-            # Perform xwing check
-            for Nrows in itertools.combinations(candidate_rows, 2):
-                if np.array_equal(array[Nrows[0],:], array[Nrows[1],:]):
-                    # Set all columns not in these rows to zero
-                    rows = np.isin(np.arange(9), Nrows, invert=True)
-                    cols = array[Nrows[0],:]
-                    array[np.outer(rows,cols)] = False 
-
-                    icols = np.where(cols)[0]
-                    print(f'Applying xwing for integer {integer} in columns {icols+1}')
-
-
-            # Check cols against cols
-            candidate_cols = np.arange(9)[array.sum(axis=0)==2] #get cols with 2 possible
-            if len(candidate_rows)>2:
-                pass
-            
-            # Peform xwing check
-            for Ncols in itertools.combinations(candidate_cols, 2):
-                if np.array_equal(array[:,Ncols[0]], array[:,Ncols[1]]):
-
-                    # Set all rows not in these columns to zero
-                    rows = array[:,Ncols[0]]
-                    cols = np.isin(np.arange(9), Ncols, invert=True)
-                    array[np.outer(rows,cols)] = False 
-
-                    irows = np.where(rows)[0]
-                    print(f'Applying xwing for integer {integer} in rows {irows}')
+        ''' Apply checks for Xwing (fish of size 2).'''
+        self.apply_fish(2)
+        return
+
+    def apply_fish(self, N=2):
+        ''' N rows (or columns) whose pmarks for an integer lie in N columns (rows) remove it from the rest of those columns (rows).
+
+        Size 2 is an Xwing, 3 a Swordfish and 4 a Jellyfish. Base lines may hold 2 to N pmarks each.
+        Only integers whose pmarks changed since the last check are examined.
+        '''
+        masks = self.candidates.masks
+        popcount, mask_digits = self.tables.popcount, self.tables.mask_digits
+        board = self.board
+        n = board.size
+        integers = self.candidates.changed_digits(('fish', N))
+        if not integers:
+            return
+        changed = sum(1<<integer for integer in integers)
+
+        # Bitmask of the columns (rows) where each changed integer is possible, per row (column)
+        row_pos = [[0]*n for integer in range(n)]
+        col_pos = [[0]*n for integer in range(n)]
+        for cell, mask in enumerate(masks):
+            irow, icol = board.cell_row[cell], board.cell_col[cell]
+            for integer in mask_digits[mask & changed]:
+                row_pos[integer][irow] |= 1<<icol
+                col_pos[integer][icol] |= 1<<irow
+
+        for integer in integers:
+            bit = 1<<integer
+
+            # Rows as base, columns as cover
+            base_rows = [(irow, pos) for irow, pos in enumerate(row_pos[integer]) if 2<=popcount[pos]<=N]
+            for Nrows, cover in covering_subsets(base_rows, N, popcount=popcount):
+                icols = mask_digits[cover]
+                touched = tuple(board.rows[irow][icol] for irow in range(n) if irow not in Nrows for icol in icols
+                                if self.candidates.eliminate(board.rows[irow][icol], bit))
+                if touched and self.reporting:
+                    self.report(FISH_NAMES[N], integer+1, Nrows, touched)
+
+            # Columns as base, rows as cover
+            base_cols = [(icol, pos) for icol, pos in enumerate(col_pos[integer]) if 2<=popcount[pos]<=N]
+            for Ncols, cover in covering_subsets(base_cols, N, popcount=popcount):
+                irows = mask_digits[cover]
+                touched = tuple(board.cols[icol][irow] for icol in range(n) if icol not in Ncols for irow in irows
+                                if self.candidates.eliminate(board.cols[icol][irow], bit))
+                if touched and self.reporting:
+                    self.report(FISH_NAMES[N], integer+1, tuple(n+icol for icol in Ncols), touched)
                     
         return
 
 
+FISH_NAMES = {2: 'xwing', 3: 'swordfish', 4: 'jellyfish'}
+
+
+# Compact state format of SudokuSolver.snapshot
+STATE_HEADER = struct.Struct('<4sBBBBI')
+STATE_MAGIC = b'SDKS'
+STATE_VERSION = 1
+STATUSES = ('unsolved', 'solved', 'unsolvable')
+
+
+def state_size(order=3):
+    ''' Size in bytes of a snapshot of a board of the given order.'''
+    board = get_board(order)
+    return STATE_HEADER.size + (array(mask_typecode(board.size)).itemsize + 1)*board.ncells
+
+
+def state_view(buffer, offset=0):
+    ''' Read a snapshot in place. Return (order, status, contradiction, iteration, masks, values).
+
+    masks and values are memoryviews into buffer (masks cast to uint16 or uint32),
+    so nothing is copied; they stay valid as long as buffer does.
+    '''
+    magic, version, order, status, contradiction, iteration = STATE_HEADER.unpack_from(buffer, offset)
+    if magic!=STATE_MAGIC or version!=STATE_VERSION:
+        raise ValueError(f'Not a version {STATE_VERSION} solver snapshot')
+    board = get_board(order)
+    typecode = mask_typecode(board.size)
+    ncells = board.ncells
+    start = offset + STATE_HEADER.size
+    end = start + array(typecode).itemsize*ncells
+    view = memoryview(buffer)
+    return order, STATUSES[status], bool(contradiction), iteration, view[start:end].cast(typecode), view[end:end+ncells]
+
+
+def evaluate_hypothesis(state, cell, integer, order=3):
+    ''' Place integer at cell and propagate singles from state (pmark masks as bytes, then one byte per value).
+
+    Return the resulting pmarks as bytes, with solved cells holding their integer's bit,
+    or None if the hypothesis leads to a contradiction.
+    '''
+    split = len(state) - get_board(order).ncells
+    solver = SudokuSolver.from_state(state[:split], state[split:], verbose=False, order=order)
+    solver.place(cell, integer)
+    solver.propagate()
+    solver.propagate_singles()
+    if solver.has_contradiction():
+        return None
+    masks = solver.candidates.masks
+    return array(masks.typecode, [mask or 1<<(value-1) for mask, value in zip(masks, solver.values)]).tobytes()
+
+
+def count_solutions(puzzle, limit=2, order=3):
+    ''' Count the solutions of puzzle (string or 2d array) up to limit; 1 means it is unique.'''
+    if not isinstance(puzzle, str):
+        puzzle = format_puzzle(puzzle)
+    return SudokuSolver(puzzle, verbose=False, techniques=(), solve=False, order=order).count_solutions(limit)
+
+# Techniques in order of increasing cost, as (name, function(solver))
+DEFAULT_TECHNIQUES = (
+    ('pointing_pairs', SudokuSolver.apply_pointing_pairs),
+    ('naked_pairs', partial(SudokuSolver.apply_nakedpairs, N=2)),
+    ('hidden_pairs', partial(SudokuSolver.apply_hiddenpairs, N=2)),
+    ('naked_triples', partial(SudokuSolver.apply_nakedpairs, N=3)),
+    ('hidden_triples', partial(SudokuSolver.apply_hiddenpairs, N=3)),
+    ('naked_quads', partial(SudokuSolver.apply_nakedpairs, N=4)),
+    ('hidden_quads', partial(SudokuSolver.apply_hiddenpairs, N=4)),
+    ('xwing', SudokuSolver.apply_xwing),
+    ('swordfish', partial(SudokuSolver.apply_fish, N=3)),
+    ('jellyfish', partial(SudokuSolver.apply_fish, N=4)),
+)
+
+# Opt-in: on the expert corpus cell forcing cuts search guesses from 435 to 63, but
+# serial solves of the bucket take about 1.7 times as long (1.15 s against 0.68 s), since
+# every hypothesis is propagated afresh; pass an executor to spread hypotheses.
+FORCING_TECHNIQUES = DEFAULT_TECHNIQUES + (
+    ('cell_forcing', SudokuSolver.apply_cell_forcing),
+)
@@ -1,34 +1,125 @@
 import numpy as np
+from functools import lru_cache
+from math import isqrt
+
+# Cell symbols in order; boards of size n use the first n, with '0' or '.' for unknown cells
+SYMBOLS = '123456789ABCDEFGHIJKLMNOP'
+
+
+class Board:
+    ''' Index tables for a board of order x order boxes: 9x9 for order 3, 16x16 for 4, 25x25 for 5.
+
+    Cells are indexed irow*size + icol; units are rows 0 to size-1, then columns,
+    then boxes.
+    '''
+
+    def __init__(self, order=3):
+        n = order*order
+        self.order = order
+        self.size = n
+        self.ncells = n*n
+        self.cell_row = tuple(cell//n for cell in range(n*n))
+        self.cell_col = tuple(cell%n for cell in range(n*n))
+        self.cell_box = tuple(order*(cell//(n*order)) + (cell%n)//order for cell in range(n*n))
+        self.rows = tuple(tuple(n*irow+icol for icol in range(n)) for irow in range(n))
+        self.cols = tuple(tuple(n*irow+icol for irow in range(n)) for icol in range(n))
+        self.boxes = tuple(tuple(n*(order*(ibox//order)+k//order) + order*(ibox%order)+k%order for k in range(n))
+                           for ibox in range(n))
+        self.units = self.rows + self.cols + self.boxes
+        self.cell_units = tuple((self.cell_row[cell], n+self.cell_col[cell], 2*n+self.cell_box[cell]) for cell in range(n*n))
+        self.peers = tuple(
+            tuple(sorted((set(self.rows[self.cell_row[cell]]) | set(self.cols[self.cell_col[cell]])
+                          | set(self.boxes[self.cell_box[cell]])) - {cell}))
+            for cell in range(n*n)
+        )
+        self.unit_cells = np.array(self.units)
+
+
+@lru_cache(maxsize=None)
+def get_board(order=3):
+    ''' Shared Board of the given order.'''
+    return Board(order)
+
+
+def order_of(size):
+    ''' Board order for a side of size cells (9 -> 3).'''
+    order = isqrt(size)
+    if order*order!=size or not 2<=order<=5:
+        raise ValueError(f'Unsupported board size {size}')
+    return order
+
+
+# Index tables of the 9x9 board, computed once. Cells are indexed irow*9 + icol;
+# units are rows 0-8, columns 9-17 and boxes 18-26.
+BOARD = get_board(3)
+CELL_ROW = BOARD.cell_row
+CELL_COL = BOARD.cell_col
+CELL_BOX = BOARD.cell_box
+ROWS = BOARD.rows
+COLS = BOARD.cols
+BOXES = BOARD.boxes
+UNITS = BOARD.units
+CELL_UNITS = BOARD.cell_units
+PEERS = BOARD.peers
+
+# Same tables as numpy arrays
+UNIT_CELLS = BOARD.unit_cells                                                # (27,9) flat cell indices
+UNIT_CELL_MAPS = np.stack((UNIT_CELLS//9, UNIT_CELLS%9), axis=2)             # (27,9,2) (irow, icol) pairs
+PEER_CELLS = np.array(PEERS)                                                 # (81,20) flat cell indices
+BOX_SLICES = tuple(np.s_[3*(ibox//3):3*(ibox//3)+3, 3*(ibox%3):3*(ibox%3)+3] for ibox in range(9))
 
 def get_box(ibox, with_offset=False):
-    irow = 3*(ibox//3)
-    icol = 3*(ibox%3)
     if with_offset:
-        return np.s_[irow:irow+3, icol:icol+3], irow, icol
+        return BOX_SLICES[ibox], 3*(ibox//3), 3*(ibox%3)
     else:
-        return np.s_[irow:irow+3, icol:icol+3]
+        return BOX_SLICES[ibox]
 
-def check_errors(puzzle):
-    '''Check for errors in puzzle.'''
-    for integer in np.arange(9)+1:
-        int_solved = puzzle==integer
+def unit_digit_counts(puzzles):
+    ''' Count each integer in every unit of a (n,n) puzzle, or of a (...,n,n) stack of them, in one pass.
 
-        # Check rows and columns for duplicates
-        for irow in range(9):
-            if int_solved[irow,:].sum()>1:
-                print(f'Multiple of {integer} in row {irow+1}')
-        
-        for icol in range(9):
-            if int_solved[:, icol].sum()>1:
-                print(f'Multiple of {integer} in column {icol}')
+    Return (...,3n,n) counts indexed [unit, integer-1], units being rows, columns then boxes.
+    '''
+    puzzles = np.asarray(puzzles)
+    n = puzzles.shape[-1]
+    unit_values = puzzles.reshape(puzzles.shape[:-2] + (n*n,))[..., get_board(order_of(n)).unit_cells]
+
+    # Offset each unit's values into its own n+1 bins and count them all at once
+    shape = unit_values.shape[:-1]
+    offsets = (n+1)*np.arange(np.prod(shape, dtype=int)).reshape(shape + (1,))
+    counts = np.bincount((unit_values + offsets).ravel(), minlength=offsets.size*(n+1))
+    return counts.reshape(shape + (n+1,))[..., 1:]
+
+def check_errors(puzzle, verbose=True, pmarks=None):
+    '''Check for repeated integers in any unit of puzzle. Return True if there are errors.
+
+    With pmarks ((n,n,n) booleans indexed [integer, row, col]), also flag unsolved
+    cells with no pmarks left and integers with no possible place left in a unit.
+    '''
+    puzzle = np.asarray(puzzle)
+    n = len(puzzle)
+    unit_cells = get_board(order_of(n)).unit_cells
+    counts = unit_digit_counts(puzzle)
+    unit_names = [f"{('row', 'column', 'box')[iunit//n]} {iunit%n+1}" for iunit in range(3*n)]
+
+    # Rows, columns and boxes with duplicates
+    errors = [f'Multiple of {integer+1} in {unit_names[iunit]}' for iunit, integer in zip(*np.nonzero(counts>1))]
 
-        # Check boxes for duplicates
-        for ibox in range(9):
-            if int_solved[get_box(ibox)].sum()>1:
-                print(f'Multiple of {integer} in box {ibox+1} ')
-                return True
+    if pmarks is not None:
+        pmarks = np.asarray(pmarks, dtype=bool)
 
-    return False
+        # Unsolved cells with no pmarks left
+        for irow, icol in zip(*np.nonzero((puzzle==0) & ~pmarks.any(axis=0))):
+            errors.append(f'No pmarks left in row {irow+1}, column {icol+1}')
+
+        # Integers neither solved nor possible in a unit
+        possible = pmarks.reshape(n, n*n)[:, unit_cells].any(axis=2).T
+        for iunit, integer in zip(*np.nonzero(~possible & (counts==0))):
+            errors.append(f'No place left for {integer+1} in {unit_names[iunit]}')
+
+    if verbose:
+        for error in errors:
+            print(error)
+    return len(errors)>0
 
 
 def report_pmarks(pmarks, row=None, col=None):
@@ -58,31 +149,53 @@ def report_pmarks(pmarks, row=None, col=None):
                 
     return 
 
-def parse_input(puzzle_string):
-    '''Parse puzzle_string into 2d array.'''
+def parse_input(puzzle_string, order=3):
+    '''Parse puzzle_string into 2d array.
 
-    row_strings = puzzle_string.split('-')
-    rows = [list(row_string) for row_string in row_strings]
+    Accepts dash-separated rows ('400008060-700020105-...') or a single line of
+    81 characters with '0' or '.' for unknown cells. Larger boards (order 4 or 5)
+    use the symbols 1-9 then A-G (16x16) or A-P (25x25), in either case.
+    '''
+    n = order*order
+    puzzle_string = puzzle_string.strip().replace('.', '0').upper()
+    if '-' in puzzle_string:
+        row_strings = puzzle_string.split('-')
+    else:
+        row_strings = [puzzle_string[i:i+n] for i in range(0, len(puzzle_string), n)]
 
-    puzzle = np.array([list(map(int, row)) for row in rows])
+    values = {symbol: k for k, symbol in enumerate('0' + SYMBOLS[:n])}
+    try:
+        puzzle = np.array([[values[char] for char in row_string] for row_string in row_strings])
+    except KeyError as error:
+        raise ValueError(f'Unknown symbol {error.args[0]!r} for a {n}x{n} puzzle: {puzzle_string!r}') from None
+    if puzzle.shape!=(n,n):
+        raise ValueError(f'Puzzle must have {n} rows of {n} symbols: {puzzle_string!r}')
     return puzzle
 
+
+def format_puzzle(puzzle):
+    '''Format 2d array as a string of one symbol per cell with 0 for unknown cells.'''
+    symbols = '0' + SYMBOLS
+    return ''.join([symbols[value] for value in np.asarray(puzzle).ravel().tolist()])
+
 def display_sudoku(puzzle):
-    output = '-------------------\n'
+    n = len(puzzle)
+    order = order_of(n)
+    output = '-'*(2*n+1) + '\n'
     # Loop over rows
-    for irow in range(9):
+    for irow in range(n):
         row_string = '|'
-        for icol in range(9):
-            char = str(puzzle[irow,icol])
+        for icol in range(n):
+            char = ('0' + SYMBOLS)[puzzle[irow,icol]]
             char = char if char!='0' else ' ' #replace 0 with empty space
 
-            sep = '|' if icol in [2,5,8] else ' '
+            sep = '|' if icol%order==order-1 else ' '
             row_string += char + sep
         output += row_string + '\n'
 
         # Add box top/bottom
-        if irow in [2,5,8]:
-            output += '-------------------\n'
+        if irow%order==order-1:
+            output += '-'*(2*n+1) + '\n'
 
     print(output)
     return
\ No newline at end of file